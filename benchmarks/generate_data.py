@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+# the ids of the different kinds of items are kept apart by their first hex digit, like real ids they are 32 hex digits
+ITEM, ALBUM, ARTIST, USER = 1, 2, 3, 4
+
+GENRES = ['Rock', 'Pop', 'Jazz', 'Soul', 'Hip-Hop', 'Electronic', 'Classical', 'Metal', 'Folk', 'Blues',
+          'Country', 'Reggae', 'Punk', 'Indie', 'Ambient', 'Soundtrack', 'Funk', 'R&B', 'Latin', 'House']
+
+# the date formats of jellyfin and of the Playback Reporting plugin
+JELLYFIN_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.0000000Z'
+ACTIVITY_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+SCHEMA = '''
+CREATE TABLE users (id TEXT PRIMARY KEY, name TEXT);
+CREATE TABLE items (id TEXT PRIMARY KEY, name TEXT, album_id TEXT, album TEXT, album_artist TEXT, artist_id TEXT,
+                    genres TEXT, run_time_ticks INTEGER, path TEXT, date_saved TEXT);
+CREATE INDEX items_artist ON items (artist_id);
+CREATE TABLE user_data (user_id TEXT, item_id TEXT, play_count INTEGER, last_played TEXT, is_favorite INTEGER,
+                        date_saved TEXT, PRIMARY KEY (user_id, item_id));
+CREATE TABLE PlaybackActivity (DateCreated DATETIME NOT NULL, UserId TEXT, ItemId TEXT, ItemType TEXT,
+                               ItemName TEXT, PlaybackMethod TEXT, ClientName TEXT, DeviceName TEXT,
+                               PlayDuration INT);
+'''
+
+
+def make_id(kind: int, number) -> str:
+    return f"{kind:x}{number:031x}"
+
+
+def date_strings(seconds: np.ndarray, date_format: str) -> list:
+    return [datetime.fromtimestamp(int(s), timezone.utc).strftime(date_format) for s in seconds]
+
+
+# write the library into the items table, albums of about a dozen songs and artists with a few albums each
+def generate_items(connection: sqlite3.Connection, rng: np.random.Generator, tracks: int, now: float):
+    album_of_track = np.sort(rng.integers(0, max(1, tracks // 12), size=tracks))
+    artist_of_album = rng.integers(0, max(1, tracks // 36), size=album_of_track.max() + 1)
+    # every album has one or two genres, some none
+    genres_of_album = [json.dumps(list(rng.choice(GENRES, size=n, replace=False))) for n in
+                       rng.choice([0, 1, 1, 1, 2], size=len(artist_of_album))]
+    run_time_ticks = (rng.gamma(9, 25, size=tracks) + 30).astype(np.int64) * 10_000_000
+    # most songs were added long ago, some recently
+    date_saved = date_strings(now - rng.exponential(365 * 24 * 60 * 60, size=tracks), JELLYFIN_DATE_FORMAT)
+    rows = []
+    for track in range(tracks):
+        album = int(album_of_track[track])
+        artist = int(artist_of_album[album])
+        rows.append((make_id(ITEM, track), f"Song {track}", make_id(ALBUM, album), f"Album {album}",
+                     f"Artist {artist}", make_id(ARTIST, artist), genres_of_album[album], int(run_time_ticks[track]),
+                     f"/music/Artist {artist}/Album {album}/{track}.flac", date_saved[track]))
+        if len(rows) == 100_000:
+            connection.executemany('INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            rows = []
+    connection.executemany('INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    return run_time_ticks // 10_000_000
+
+
+# write a play history for every user: a few plays per day drawn from the user's own skewed taste, most of them
+# played to the end and some skipped. The user data (play counts, last played) is derived from the history
+def generate_history(connection: sqlite3.Connection, rng: np.random.Generator, users: int, tracks: int, days: int,
+                     plays_per_day: float, lengths: np.ndarray, now: float):
+    for user in range(users):
+        user_id = make_id(USER, user)
+        connection.execute('INSERT INTO users VALUES (?, ?)', (user_id, f"user{user}"))
+        plays = rng.poisson(plays_per_day * days)
+        # a zipf like popularity over a random order of the songs
+        taste = rng.permutation(tracks)
+        tracks_played = taste[np.minimum(rng.pareto(1.1, size=plays) * tracks / 50, tracks - 1).astype(np.int64)]
+        played_at = np.sort(now - rng.random(plays) * days * 24 * 60 * 60)
+        skipped = rng.random(plays) < 0.2
+        duration = np.where(skipped, rng.random(plays) * lengths[tracks_played], lengths[tracks_played])
+        dates = date_strings(played_at, ACTIVITY_DATE_FORMAT)
+        connection.executemany('INSERT INTO PlaybackActivity VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               ((dates[i], user_id, make_id(ITEM, int(tracks_played[i])), 'Audio',
+                                 f"Song {tracks_played[i]}", 'DirectPlay', 'Jellyfin Web', 'Firefox',
+                                 int(duration[i])) for i in range(plays)))
+
+        play_count = np.bincount(tracks_played, minlength=tracks)
+        last_played = np.zeros(tracks)
+        last_played[tracks_played] = played_at  # the plays are sorted, so the last write is the latest play
+        favourite = rng.random(tracks) < 0.02
+        with_data = np.flatnonzero((play_count > 0) | favourite)
+        last_played_dates = date_strings(last_played[with_data], JELLYFIN_DATE_FORMAT)
+        connection.executemany('INSERT INTO user_data VALUES (?, ?, ?, ?, ?, ?)',
+                               ((user_id, make_id(ITEM, int(track)), int(play_count[track]),
+                                 last_played_dates[i] if play_count[track] else None, bool(favourite[track]),
+                                 last_played_dates[i]) for i, track in enumerate(with_data)))
+
+
+def generate(path: str, tracks: int, users: int, days: int, plays_per_day: float, seed: int):
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    rng = np.random.default_rng(seed)
+    now = time.time()
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            connection.executescript(SCHEMA)
+            lengths = generate_items(connection, rng, tracks, now)
+            generate_history(connection, rng, users, tracks, days, plays_per_day, lengths, now)
+            connection.execute('CREATE INDEX activity_user ON PlaybackActivity (UserId, DateCreated)')
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic library and listen history for the mock server.")
+    parser.add_argument('--tracks', type=int, default=10_000, help="number of songs in the library")
+    parser.add_argument('--users', type=int, default=2, help="number of users, named user0, user1, ...")
+    parser.add_argument('--days', type=int, default=730, help="days of listen history of every user")
+    parser.add_argument('--plays-per-day', type=float, default=40, help="average plays per user and day")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(__file__), 'data', 'library.sqlite'))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    generate(args.out, args.tracks, args.users, args.days, args.plays_per_day, args.seed)
+    print(f"Generated {args.tracks} songs and {args.days} days of history for {args.users} users in "
+          f"{time.perf_counter() - start:.1f}s: {args.out}")
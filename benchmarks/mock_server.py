@@ -0,0 +1,290 @@
+import argparse
+import json
+import re
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# playlists get ids with their own first hex digit, next to the ones of generate_data.py
+PLAYLIST = 5
+
+
+# a solid color png of the given size, made without Pillow so that the mock only needs the standard library
+@lru_cache(maxsize=256)
+def solid_png(width: int, height: int, color: tuple) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    row = b'\0' + bytes(color) * width
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(row * height)) + chunk(b'IEND', b''))
+
+
+# the state of the mock server: the generated library in sqlite and the playlists and sessions in memory
+class MockJellyfin:
+    def __init__(self, path: str, sessions: int = 0, latency: float = 0.0):
+        self.path = path
+        self.latency = latency
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.playlists = {}
+        self.messages = 0
+        self.total_items = self.db().execute('SELECT COUNT(*) FROM items').fetchone()[0]
+        self.sessions = self._make_sessions(sessions)
+
+    # every request thread has its own connections, the custom queries can only read
+    def db(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'db'):
+            self._local.db = sqlite3.connect(self.path)
+        return self._local.db
+
+    def read_only_db(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'read_only_db'):
+            self._local.read_only_db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        return self._local.read_only_db
+
+    def _make_sessions(self, count: int) -> list:
+        rows = self.db().execute('SELECT id, name, run_time_ticks FROM items ORDER BY RANDOM() LIMIT ?', (count,))
+        return [{'Id': f"{PLAYLIST + 1:x}{i:031x}", 'UserName': 'user0', 'Client': 'Jellyfin Web',
+                 'NowPlayingItem': {'Id': item_id, 'Name': name, 'RunTimeTicks': ticks},
+                 'PlayState': {'PositionTicks': ticks // 2, 'IsPaused': False}}
+                for i, (item_id, name, ticks) in enumerate(rows)]
+
+    def users(self) -> list:
+        return [{'Id': user_id, 'Name': name} for user_id, name in self.db().execute('SELECT id, name FROM users')]
+
+    @staticmethod
+    def _item(row: tuple, user_data: bool, fields: bool) -> dict:
+        (item_id, name, album_id, album, album_artist, artist_id, genres, ticks, path, _,
+         play_count, last_played, is_favorite) = row
+        item = {'Id': item_id, 'Name': name, 'Type': 'Audio', 'AlbumId': album_id, 'Album': album,
+                'AlbumArtist': album_artist, 'Artists': [album_artist],
+                'AlbumArtists': [{'Id': artist_id, 'Name': album_artist}], 'RunTimeTicks': ticks}
+        if fields:
+            item['Path'] = path
+            item['Genres'] = json.loads(genres)
+        if user_data:
+            item['UserData'] = {'PlayCount': play_count or 0, 'IsFavorite': bool(is_favorite), 'Played': bool(play_count)}
+            if last_played:
+                item['UserData']['LastPlayedDate'] = last_played
+        return item
+
+    # the audio items with the paging and the date filters the scripts use, in the order of the library
+    def items(self, user_id: str | None, query: dict) -> dict:
+        if query.get('IncludeItemTypes') == 'Playlist':
+            playlists = [{'Id': playlist_id, 'Name': playlist['Name'], 'Type': 'Playlist'}
+                         for playlist_id, playlist in self.playlists.items() if playlist['UserId'] == user_id]
+            return {'Items': playlists, 'TotalRecordCount': len(playlists)}
+        start = int(query.get('StartIndex', 0))
+        limit = int(query['Limit']) if 'Limit' in query else -1
+        sql = 'SELECT i.*, u.play_count, u.last_played, u.is_favorite FROM items i ' \
+              'LEFT JOIN user_data u ON u.item_id = i.id AND u.user_id = ? '
+        conditions, params = [], [user_id]
+        if 'MinDateLastSaved' in query:
+            conditions.append('i.date_saved >= ?')
+            params.append(query['MinDateLastSaved'])
+        if 'MinDateLastSavedForUser' in query:
+            conditions.append('u.date_saved >= ?')
+            params.append(query['MinDateLastSavedForUser'])
+        if conditions:
+            sql += 'WHERE ' + ' AND '.join(conditions) + ' '
+            total = self.db().execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+            rows = self.db().execute(sql + 'ORDER BY i.rowid LIMIT ? OFFSET ?', params + [limit, start])
+        else:
+            # the rows are numbered without gaps, so a page is a range of row ids instead of a slow OFFSET
+            total = self.total_items
+            rows = self.db().execute(sql + 'WHERE i.rowid > ? ORDER BY i.rowid LIMIT ?', params + [start, limit])
+        fields = query.get('Fields') != ''
+        return {'Items': [self._item(row, user_id is not None, fields) for row in rows], 'TotalRecordCount': total,
+                'StartIndex': start}
+
+    # songs of the same artist, then of the same album genres
+    def similar(self, item_id: str, limit: int) -> dict:
+        row = self.db().execute('SELECT artist_id, genres FROM items WHERE id = ?', (item_id,)).fetchone()
+        if row is None:
+            return {'Items': [], 'TotalRecordCount': 0}
+        ids = [i for i, in self.db().execute('SELECT id FROM items WHERE artist_id = ? AND id != ? LIMIT ?',
+                                             (row[0], item_id, limit))]
+        if len(ids) < limit:
+            ids += [i for i, in self.db().execute('SELECT id FROM items WHERE genres = ? AND artist_id != ? LIMIT ?',
+                                                  (row[1], row[0], limit - len(ids)))]
+        return {'Items': [{'Id': i, 'Type': 'Audio'} for i in ids], 'TotalRecordCount': len(ids)}
+
+    def custom_query(self, query: str) -> dict:
+        cursor = self.read_only_db().execute(query)
+        # the plugin answers with all values as strings, and the columns under this name
+        return {'colums': [column[0] for column in cursor.description or []],
+                'results': [[str(value) for value in row] for row in cursor], 'message': ''}
+
+    def create_playlist(self, body: dict) -> dict:
+        with self._lock:
+            playlist_id = f"{PLAYLIST:x}{len(self.playlists) + 1:031x}"
+            while playlist_id in self.playlists:
+                playlist_id = f"{PLAYLIST:x}{int(playlist_id[1:], 16) + 1:031x}"
+            self.playlists[playlist_id] = {'Name': body.get('Name'), 'UserId': body.get('UserId'), 'Items': []}
+        self.add_to_playlist(playlist_id, body.get('Ids') or [])
+        return {'Id': playlist_id}
+
+    # the entries of a playlist have their own ids, the same song can be in a playlist twice
+    def playlist_items(self, playlist_id: str) -> dict | None:
+        if playlist_id not in self.playlists:
+            return None
+        items = [{'Id': item_id, 'PlaylistItemId': entry_id, 'Type': 'Audio'}
+                 for item_id, entry_id in self.playlists[playlist_id]['Items']]
+        return {'Items': items, 'TotalRecordCount': len(items)}
+
+    def add_to_playlist(self, playlist_id: str, item_ids: list) -> bool:
+        with self._lock:
+            if playlist_id not in self.playlists:
+                return False
+            self.playlists[playlist_id]['Items'] += [(item_id, uuid.uuid4().hex) for item_id in item_ids]
+        return True
+
+    def remove_from_playlist(self, playlist_id: str, entry_ids: list) -> bool:
+        with self._lock:
+            if playlist_id not in self.playlists:
+                return False
+            entry_ids = set(entry_ids)
+            self.playlists[playlist_id]['Items'] = [i for i in self.playlists[playlist_id]['Items']
+                                                    if i[1] not in entry_ids]
+        return True
+
+    # like jellyfin the entry is taken out first, the index counts the entries without it
+    def move_in_playlist(self, playlist_id: str, entry_id: str, index: int) -> bool:
+        with self._lock:
+            items = self.playlists.get(playlist_id, {}).get('Items', [])
+            positions = [i for i, (_, entry) in enumerate(items) if entry == entry_id]
+            if not positions:
+                return False
+            items.insert(index, items.pop(positions[0]))
+        return True
+
+    def delete_item(self, item_id: str) -> bool:
+        with self._lock:
+            return self.playlists.pop(item_id, None) is not None
+
+    # answer a request, returns the status, the body and its content type. Used by the http server and by the
+    # in-process client of the benchmarks
+    def handle(self, method: str, path: str, query: dict, body: dict = None) -> tuple[int, object, str]:
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'GET':
+            if path == '/Users':
+                return 200, self.users(), 'application/json'
+            if path == '/Sessions':
+                return 200, self.sessions, 'application/json'
+            if path == '/Items':
+                return 200, self.items(None, query), 'application/json'
+            match = re.fullmatch(r'/Users/(\w+)/Items', path)
+            if match:
+                return 200, self.items(match.group(1), query), 'application/json'
+            match = re.fullmatch(r'/Items/(\w+)/similar', path, re.IGNORECASE)
+            if match:
+                return 200, self.similar(match.group(1), int(query.get('Limit', 12))), 'application/json'
+            match = re.fullmatch(r'/Playlists/(\w+)/Items', path)
+            if match:
+                items = self.playlist_items(match.group(1))
+                return (200, items, 'application/json') if items is not None else (404, {}, 'application/json')
+            match = re.fullmatch(r'/Items/(\w+)/Images/Primary', path)
+            if match:
+                # a different color for every item, in the size that was asked for
+                color = tuple(bytes.fromhex(match.group(1)[-6:].rjust(6, '0')))
+                size = (int(query.get('fillWidth', 300)), int(query.get('fillHeight', 300)))
+                return 200, solid_png(*size, color), 'image/png'
+        elif method == 'POST':
+            if path == '/user_usage_stats/submit_custom_query':
+                try:
+                    return 200, self.custom_query(body['CustomQueryString']), 'application/json'
+                except sqlite3.Error as e:
+                    return 500, {'message': str(e)}, 'application/json'
+            if path == '/Playlists':
+                return 200, self.create_playlist(body), 'application/json'
+            match = re.fullmatch(r'/Playlists/(\w+)/Items', path)
+            if match:
+                ids = [i for i in query.get('Ids', '').split(',') if i]
+                return (204 if self.add_to_playlist(match.group(1), ids) else 404), None, 'application/json'
+            match = re.fullmatch(r'/Playlists/(\w+)/Items/(\w+)/Move/(\d+)', path)
+            if match:
+                moved = self.move_in_playlist(match.group(1), match.group(2), int(match.group(3)))
+                return (204 if moved else 404), None, 'application/json'
+            if re.fullmatch(r'/Sessions/(\w+)/Message', path):
+                with self._lock:
+                    self.messages += 1
+                return 204, None, 'application/json'
+        elif method == 'DELETE':
+            match = re.fullmatch(r'/Playlists/(\w+)/Items', path)
+            if match:
+                ids = [i for i in query.get('EntryIds', '').split(',') if i]
+                return (204 if self.remove_from_playlist(match.group(1), ids) else 404), None, 'application/json'
+            match = re.fullmatch(r'/Items/(\w+)', path)
+            if match and self.delete_item(match.group(1)):
+                return 204, None, 'application/json'
+        return 404, {}, 'application/json'
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: 'MockServer'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self, method: str):
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length) or b'{}') if length else None
+        status, payload, content_type = self.server.jellyfin.handle(method, url.path, query, body)
+        if isinstance(payload, bytes):
+            data = payload
+        else:
+            data = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple, jellyfin: MockJellyfin):
+        super().__init__(address, Handler)
+        self.jellyfin = jellyfin
+
+
+# start the mock server in a background thread, e.g. for benchmarks. Returns the server and its url
+def serve_in_background(path: str, port: int = 0, sessions: int = 0, latency: float = 0.0) -> tuple[MockServer, str]:
+    server = MockServer(('127.0.0.1', port), MockJellyfin(path, sessions, latency))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="A local stand-in for a Jellyfin server with Playback Reporting, "
+                                                 "serving the data made by generate_data.py.")
+    parser.add_argument('--data', default='benchmarks/data/library.sqlite', help="database from generate_data.py")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8096)
+    parser.add_argument('--sessions', type=int, default=0, help="number of sessions that are playing something")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    args = parser.parse_args()
+
+    mock = MockServer((args.host, args.port), MockJellyfin(args.data, args.sessions, args.latency))
+    print(f"Mock Jellyfin server on http://{args.host}:{mock.server_address[1]}, set this as JELLYFIN_IP")
+    mock.serve_forever()
@@ -0,0 +1,197 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+# the stages run on the data of the benchmark only, never on a local cache
+os.environ['CACHE_DIR'] = ''
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+import jellyfin_music
+import jellyfin_wrapped
+from jellyfin_images import ItemImages
+from jellyfin_playlist import Playlists
+from jellyfin_similar import SimilarItems
+from generate_data import generate
+from mock_server import MockJellyfin
+from stub_client import StubClient
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+DATA_DIR = os.path.join(BENCHMARK_DIR, 'data')
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'baselines.json')
+PLAYLIST_SECONDS = 6 * 60 * 60
+
+
+# a library of `size` songs and about as many plays over the last year, generated once and reused
+def dataset(size: int) -> str:
+    path = os.path.join(DATA_DIR, f"bench_{size}.sqlite")
+    if not os.path.exists(path):
+        print(f"Generating the data for {size} songs")
+        generate(path, tracks=size, users=1, days=365, plays_per_day=size / 365, seed=0)
+    return path
+
+
+# point the scripts at the stub client, the caches are new for every size so nothing carries over
+def use_client(client: StubClient):
+    jellyfin_music.client = client
+    jellyfin_music.similar_items = SimilarItems(client, cache_dir=None)
+    jellyfin_music.playlists = Playlists(client, cache_dir=None)
+    jellyfin_wrapped.client = client
+    jellyfin_wrapped.artist_images = ItemImages(client, query='?fillHeight=500&fillWidth=500&quality=96',
+                                                cache_dir=None)
+
+
+def clear_render_caches():
+    for cached in (jellyfin_wrapped._gradient, jellyfin_wrapped.load_font, jellyfin_wrapped.text_width,
+                   jellyfin_wrapped.load_logo):
+        cached.cache_clear()
+
+
+# the stages of the playlist and the wrapped pipelines. Every stage gets a function that prepares fresh inputs, so
+# that a stage that changes its inputs can be repeated, and the stage itself
+def stages(user_id: str, state: dict) -> dict:
+    def recent_listen_data():
+        week_ago = (datetime.datetime.now() - datetime.timedelta(days=7)).strftime('%Y-%m-%d %H:%M:%S')
+        return [i for i in state['listen_data'] if i[0] > week_ago] or state['listen_data'][:100]
+
+    def listen_frame():
+        return pd.DataFrame(state['listen_data'], columns=['date_created', 'item_id', 'play_duration'])
+
+    def render(artist_img):
+        clear_render_caches()
+        return jellyfin_wrapped.make_info_image(io.BytesIO(artist_img), ['Artist'] * 5, 12345,
+                                                ['A song with a rather long name'] * 5, 'Rock')
+
+    return {
+        'get_all_songs': (lambda: (user_id,), jellyfin_music.get_all_songs),
+        'get_listen_data': (lambda: (user_id,), jellyfin_music.get_listen_data),
+        'culminate_potential_songs': (lambda: (state['song_df'], recent_listen_data(), np.random.default_rng(0)),
+                                      jellyfin_music.culminate_potential_songs),
+        'prune_playlist': (lambda: (state['song_df'], state['listen_data'], list(state['candidates']),
+                                    PLAYLIST_SECONDS, np.random.default_rng(0)), jellyfin_music.prune_playlist),
+        'create_random_playlist': (lambda: (state['song_df'], state['listen_data'], 7, PLAYLIST_SECONDS, 0),
+                                   jellyfin_music.create_random_playlist),
+        'rank_by_most_listened': (lambda: (state['song_df'], listen_frame()),
+                                  lambda songs, listens: jellyfin_wrapped.rank_by_most_listened(
+                                      songs, jellyfin_wrapped.item_stats(listens))),
+        'total_play_time': (lambda: (listen_frame(), state['song_df']), jellyfin_wrapped.total_play_time),
+        'make_info_image': (lambda: (state['artist_img'],), render),
+    }
+
+
+# seconds of the fastest of `repeat` runs and the peak traced memory of one more run. A first run that is not
+# measured records the answers of the stub client
+def measure(prepare, stage, repeat: int) -> tuple[object, float, float]:
+    seconds = float('inf')
+    result = stage(*prepare())
+    for _ in range(repeat):
+        args = prepare()
+        start = time.perf_counter()
+        result = stage(*args)
+        seconds = min(seconds, time.perf_counter() - start)
+    args = prepare()
+    tracemalloc.start()
+    try:
+        stage(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak / 1e6
+
+
+def run_size(size: int, repeat: int, only: list = None) -> dict:
+    mock = MockJellyfin(dataset(size))
+    client = StubClient(mock)
+    use_client(client)
+    user_id = mock.users()[0]['Id']
+    state = {}
+    results = {}
+    # the logo is read from the working directory
+    with tempfile.TemporaryDirectory() as directory:
+        Image.new('RGBA', (300, 100), (0, 164, 220, 255)).save(os.path.join(directory, 'jellyfin_logo.png'))
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            for name, (prepare_inputs, stage) in stages(user_id, state).items():
+                # the similar items and images are requested again by every run
+                def prepare():
+                    use_client(client)
+                    return prepare_inputs()
+
+                # the stages depend on each other, so the ones that are not reported still run once
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if only and name not in only:
+                        result, seconds, peak = stage(*prepare()), None, None
+                    else:
+                        result, seconds, peak = measure(prepare, stage, repeat)
+                if name == 'get_all_songs':
+                    state['song_df'] = result
+                    artist_id = result['artist_id'].dropna().iloc[0]
+                    state['artist_img'] = client.get(f"/Items/{artist_id}/Images/Primary?fillHeight=500"
+                                                     f"&fillWidth=500&quality=96").content
+                elif name == 'get_listen_data':
+                    state['listen_data'] = result
+                elif name == 'culminate_potential_songs':
+                    state['candidates'] = result
+                if seconds is not None:
+                    results[name] = {'seconds': round(seconds, 4), 'peak_mb': round(peak, 2)}
+                    print(f"{size:>9} {name:<28} {seconds:>9.3f}s {peak:>10.1f} MB")
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+# stages that got slower than the baseline by more than the tolerance, small absolute times are ignored as noise
+def regressions(results: dict, baselines: dict, tolerance: float, min_seconds: float = 0.05) -> list:
+    slower = []
+    for size, stage_results in results.items():
+        for name, result in stage_results.items():
+            baseline = baselines.get(size, {}).get(name)
+            if baseline and result['seconds'] > max(baseline['seconds'] * tolerance, min_seconds):
+                slower.append(f"{name} at {size}: {result['seconds']:.3f}s, baseline {baseline['seconds']:.3f}s")
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the stages of the playlist and wrapped pipelines on synthetic "
+                                                 "libraries of increasing size.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="numbers of songs (and plays), e.g. 1000 10000 100000 1000000")
+    parser.add_argument('--stages', nargs='+', help="only report these stages")
+    parser.add_argument('--repeat', type=int, default=3, help="the fastest of this many runs is reported")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="json file with the baseline times")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help="a stage counts as regressed if it is this many times slower than the baseline")
+    args = parser.parse_args()
+
+    print(f"{'size':>9} {'stage':<28} {'time':>10} {'peak memory':>13}")
+    results = {str(size): run_size(size, args.repeat, args.stages) for size in args.sizes}
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.save_baseline:
+        for size, stage_results in results.items():
+            baselines.setdefault(size, {}).update(stage_results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved the baseline to {args.baseline}")
+    else:
+        slower = regressions(results, baselines, args.tolerance)
+        for regression in slower:
+            print(f"Regression: {regression}")
+        if slower:
+            sys.exit(1)
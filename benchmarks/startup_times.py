@@ -0,0 +1,52 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the heavy dependencies, reported if starting a script loads them
+HEAVY_MODULES = ['numpy', 'pandas', 'PIL', 'matplotlib', 'seaborn', 'requests', 'websocket']
+
+SCRIPTS = ['jellyfin_music', 'jellyfin_wrapped', 'in_depth_analysis', 'jellyfin_based_shutdown']
+
+# run in a fresh interpreter, the output of the script is hidden and the heavy modules it loaded are printed
+CHECK = '''import contextlib, io, runpy, sys
+with contextlib.redirect_stdout(io.StringIO()):
+    {}
+print(','.join(m for m in {!r} if m in sys.modules))
+'''
+HELP = "sys.argv = ['{0}.py', '--help']\n    with contextlib.suppress(SystemExit):\n" \
+       "        runpy.run_path('{0}.py', run_name='__main__')"
+
+
+# seconds of the fastest of `repeat` starts of the code in the given checkout and the heavy modules it loaded,
+# None if the code failed
+def cold_start(root: str, code: str, repeat: int) -> tuple[float, list | None]:
+    seconds = float('inf')
+    loaded = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', CHECK.format(code, HEAVY_MODULES)], cwd=root,
+                                capture_output=True, text=True)
+        seconds = min(seconds, time.perf_counter() - start)
+        loaded = [i for i in result.stdout.strip().split(',') if i] if result.returncode == 0 else None
+    return seconds, loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure how long the scripts take to start in a fresh interpreter, "
+                                                 "for importing them and for printing their --help.")
+    parser.add_argument('--root', default=os.path.dirname(BENCHMARK_DIR),
+                        help="checkout of the scripts to measure, e.g. an older version to compare with")
+    parser.add_argument('--repeat', type=int, default=5, help="the fastest of this many starts is reported")
+    args = parser.parse_args()
+
+    print(f"{'command':<40} {'time':>8}  heavy modules loaded")
+    runs = [('python (interpreter only)', 'pass')]
+    for script in SCRIPTS:
+        runs += [(f"import {script}", f"import {script}"), (f"{script}.py --help", HELP.format(script))]
+    for name, code in runs:
+        seconds, loaded = cold_start(args.root, code, args.repeat)
+        print(f"{name:<40} {seconds:>7.3f}s  {', '.join(loaded) if loaded is not None else 'failed'}")
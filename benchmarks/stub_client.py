@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jellyfin_client import JellyfinClient, endpoint
+from mock_server import MockJellyfin
+
+
+class StubResponse:
+    def __init__(self, status_code: int, payload, content_type: str):
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = {'Content-Type': content_type}
+
+    @property
+    def content(self) -> bytes:
+        if isinstance(self._payload, bytes):
+            return self._payload
+        return json.dumps(self._payload).encode() if self._payload is not None else b''
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error from the mock server", response=self)
+
+
+# a client that answers from the mock server in the same process, without http, so that the benchmarks measure
+# the scripts and not the network. With record, the answers to GET requests are kept and replayed, so that repeated
+# runs don't measure the mock server either. The Playback Reporting queries are answered every time, replaying them
+# would leave nothing of get_listen_data to measure. The metrics are recorded like by the real client
+class StubClient(JellyfinClient):
+    def __init__(self, jellyfin: MockJellyfin, record: bool = True):
+        super().__init__('http://stub', 'stub', 'Benchmark', 'Benchmark', '1.0.0')
+        self.jellyfin = jellyfin
+        self.record = record
+        self.recorded = {}
+
+    def request(self, method: str, path: str, retry: bool = None, timeout=None, **kwargs) -> StubResponse:
+        url = urlsplit(path)
+        query = {key: values[0] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        query.update({key: str(value) for key, value in (kwargs.get('params') or {}).items()})
+        start = time.perf_counter()
+        # the playlists change between requests
+        read_only = method == 'GET' and not url.path.startswith('/Playlists') and \
+            query.get('IncludeItemTypes') != 'Playlist'
+        key = (method, url.path, tuple(sorted(query.items())), json.dumps(kwargs.get('json'), sort_keys=True))
+        if self.record and read_only and key in self.recorded:
+            response = self.recorded[key]
+        else:
+            response = StubResponse(*self.jellyfin.handle(method, url.path, query, kwargs.get('json')))
+            if self.record and read_only:
+                self.recorded[key] = response
+        # the size of the body is left out, serializing it would only be measured for the metrics
+        self._record(endpoint(path), time.perf_counter() - start, 0, response.status_code >= 400)
+        return response
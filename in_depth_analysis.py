@@ -1,23 +1,19 @@
-from jellyfin_wrapped import get_data
-from matplotlib import pyplot as plt
-import matplotlib.colors as mcolors
-import seaborn as sns
-import pandas as pd
+import argparse
+from jellyfin_wrapped import JF_COLOR, colormap, get_data, profiler
+from jellyfin_profile import add_arguments
 
-JF_COLOR = "#000B25"
-CMAP = mcolors.LinearSegmentedColormap.from_list("", ["#AA5CC3", "#00A4DC"])
-
-best_artists, best_songs, total_listen_time, best_genres, artist_img, all_music, listen_data = get_data(get_raw=True)
+# matplotlib, seaborn and pandas are imported by the plots, so that the module can be imported without them
 
 
 def listen_timeline(listen_data, save=False):
+    import matplotlib.colors as mcolors
+    import pandas as pd
+    import seaborn as sns
+    from matplotlib import pyplot as plt
     timeline_data = listen_data.copy()
-    # make sure the play_duration does not exceed the length of the song otherwise cap it at 5 minutes
-    for i, row in timeline_data.iterrows():
-        if row['item_id'] in all_music.index:
-            timeline_data.at[i, 'play_duration'] = min(row['play_duration'], all_music.loc[row['item_id']]['length'])
-        else:
-            timeline_data.at[i, 'play_duration'] = min(row['play_duration'], 300)
+    # make sure the play_duration does not exceed the length of the song otherwise cap it at 5 minutes,
+    # the capped durations were already computed for the total play time
+    timeline_data['play_duration'] = timeline_data['capped_play_duration']
 
     timeline_data['date_created'] = pd.to_datetime(timeline_data['date_created'])
     timeline_data = timeline_data.set_index('date_created')
@@ -38,7 +34,7 @@ def listen_timeline(listen_data, save=False):
     for i in range(len(x) - 1):
         plt.fill_between(
             [x[i], x[i + 1]], [y[i], y[i + 1]],
-            color=CMAP(time_norm((time_numeric[i] + time_numeric[i + 1]) / 2)),
+            color=colormap()(time_norm((time_numeric[i] + time_numeric[i + 1]) / 2)),
             alpha=0.8
         )
     plt.title("Minutes listened per day")
@@ -58,6 +54,8 @@ def listen_timeline(listen_data, save=False):
 
 
 def most_items(best_artists, best_genres, listen_data, save=False):
+    import seaborn as sns
+    from matplotlib import pyplot as plt
     timeline_data = listen_data.copy()
     # remove rows with play duration 0
     timeline_data = timeline_data[timeline_data['play_duration'] > 0]
@@ -73,7 +71,7 @@ def most_items(best_artists, best_genres, listen_data, save=False):
     song_df = song_df.dropna(subset='song_name')
 
     # ten colors for the bar plots from the gradient
-    colors = [CMAP(i / 10) for i in range(10)]
+    colors = [colormap()(i / 10) for i in range(10)]
 
 
     fig, ax = plt.subplots(3, 1, figsize=(15, 15))
@@ -106,6 +104,7 @@ def most_items(best_artists, best_genres, listen_data, save=False):
 
 
 def birthday_song(listen_data, birthday):
+    import pandas as pd
     timeline_data = listen_data.copy()
     timeline_data['date_created'] = pd.to_datetime(timeline_data['date_created'])
     timeline_data['date_created'] = timeline_data['date_created'].dt.strftime('%m-%d')
@@ -125,6 +124,24 @@ def birthday_song(listen_data, birthday):
     # print the top song
     print(f"Most listened song on your birthday: {song_play_count['song_name'].iloc[0]}")
 
-birthday_song(listen_data, '06-08')
-most_items(best_artists, best_genres, listen_data, save=True)
-listen_timeline(listen_data, save=True)
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog, description="Plot the listen history of the last year.")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    profiler.script = 'in_depth_analysis'
+    profiler.start(args)
+
+    best_artists, best_songs, total_listen_time, best_genres, artist_img, all_music, listen_data = get_data(get_raw=True)
+
+    with profiler.stage('birthday_song'):
+        birthday_song(listen_data, '06-08')
+    with profiler.stage('most_items'):
+        most_items(best_artists, best_genres, listen_data, save=True)
+    with profiler.stage('listen_timeline'):
+        listen_timeline(listen_data, save=True)
+    profiler.finish()
+
+
+if __name__ == '__main__':
+    main()
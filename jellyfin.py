@@ -0,0 +1,26 @@
+import argparse
+import importlib
+
+# the script behind every command, only the one that runs is imported
+COMMANDS = {
+    'playlist': ('jellyfin_music', "create a random daily playlist based on the recent listen history"),
+    'wrapped': ('jellyfin_wrapped', "create a Spotify Wrapped like summary of the last year of music"),
+    'analysis': ('in_depth_analysis', "plot the listen history of the last year"),
+    'shutdown': ('jellyfin_based_shutdown', "shut down the server once the current episodes have finished"),
+}
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(
+        description="Scripts for a Jellyfin server. Run a command with --help to see its options.",
+        epilog="commands:\n" + "\n".join(f"  {name:<12}{description}" for name, (_, description) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=COMMANDS, metavar='command')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help="options of the command")
+    args = parser.parse_args(argv)
+    module = importlib.import_module(COMMANDS[args.command][0])
+    module.main(args.args, prog=f"{parser.prog} {args.command}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,61 +1,226 @@
+import argparse
+import json
 import subprocess
 import time
-import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from jellyfin_client import JellyfinClient
+from jellyfin_profile import Profiler, add_arguments
 
 load_dotenv()
 
 api_key = os.getenv('API_KEY')
 jellyfin_ip = os.getenv('JELLYFIN_IP')
 wakeup_time = os.getenv('WAKEUP_TIME')
+# seconds between two looks at the sessions when they are polled instead of pushed over the WebSocket
+POLL_INTERVAL = int(os.getenv('SHUTDOWN_POLL_INTERVAL')) if os.getenv('SHUTDOWN_POLL_INTERVAL') else 30
+# seconds all sessions have to stay idle before shutting down, so that the next episode can start
+IDLE_GRACE = int(os.getenv('SHUTDOWN_IDLE_GRACE')) if os.getenv('SHUTDOWN_IDLE_GRACE') else 60
+# minutes before the shutdown at which all sessions are reminded again
+NOTICE_MINUTES = [int(i) for i in os.getenv('SHUTDOWN_NOTICES').split(',')] if os.getenv('SHUTDOWN_NOTICES') \
+    else [10, 5, 1]
 
 client = 'ShutdownScript'
 device = 'ShutdownScript'
 VERSION = '1.0.0'
-headers = {'Authorization': f'MediaBrowser Client="{client}", Device="{device}",'
-                            f'Version="{VERSION}", Token="{api_key}"'}
+jellyfin = JellyfinClient(jellyfin_ip, api_key, client, device, VERSION)
+profiler = Profiler(jellyfin, 'shutdown')
+
+
+# raises a requests.RequestException if the server answers with an error, or a ValueError if the answer is not json
+def get_sessions() -> list:
+    sessions = jellyfin.get("/Sessions?ActiveWithinSeconds=300")
+    sessions.raise_for_status()
+    return sessions.json()
+
+
+# ticks until the item of the session has finished playing, 0 if nothing is playing
+def remaining_ticks(session: dict) -> int:
+    try:
+        if session['PlayState']['PositionTicks'] > 0:
+            return session['NowPlayingItem']['RunTimeTicks'] - session['PlayState']['PositionTicks']
+    except KeyError:
+        pass
+    return 0
+
+
+# a session keeps the server running while it plays something, a paused item counts as well
+def is_busy(session: dict) -> bool:
+    return 'NowPlayingItem' in session
+
+
+# returns True if the message reached the session, the request times out after the timeout of the message endpoint
+def post_message(session_id: str, message: dict) -> bool:
+    import requests
+    try:
+        response = jellyfin.post(f"/Sessions/{session_id}/Message", json=message)
+    except requests.RequestException:
+        return False
+    return response.status_code < 400
+
+
+# send the messages to all sessions at the same time, so that one unresponsive client does not hold up the others
+def notify_sessions(messages: dict[str, dict]) -> tuple[int, int]:
+    if not messages:
+        return 0, 0
+    with ThreadPoolExecutor(max_workers=min(16, len(messages))) as executor:
+        results = list(executor.map(post_message, messages, messages.values()))
+    delivered = sum(results)
+    profiler.add('messages_delivered', delivered)
+    profiler.add('messages_failed', len(results) - delivered)
+    return delivered, len(results) - delivered
+
+
+# a notice that can't be sent is counted as failed, it must not stop the countdown to the shutdown
+def notify_all(text: str):
+    import requests
+    message = {"Text": text, "TimeoutMS": 5000}
+    try:
+        sessions = get_sessions()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Could not get the sessions, the notice was not sent ({e}): {text}")
+        profiler.add('messages_failed', 1)
+        return
+    delivered, failed = notify_sessions({i['Id']: message for i in sessions})
+    print(f"Messaged {delivered} session(s), {failed} failed: {text}")
 
 
 def send_message():
-    sessions = requests.get(f"{jellyfin_ip}/Sessions?ActiveWithinSeconds=300", headers=headers)
-    session_data = sessions.json()
-    active_sessions = 0
-    session_ids = []
+    session_data = get_sessions()
+    profiler.set('sessions', len(session_data))
     time_to_shutdown = 0
     longest_session = ""
     for i in session_data:
-        try:
-            if i['PlayState']['PositionTicks'] > 0:
-                curr_tick_pos = i['PlayState']['PositionTicks']
-                episode_ticks = i['NowPlayingItem']['RunTimeTicks']
-                tmp = episode_ticks - curr_tick_pos
-                if tmp > time_to_shutdown:
-                    time_to_shutdown = tmp
-                    longest_session = i['Id']
-        except KeyError:
-            pass
-        session_ids.append(i['Id'])
-        active_sessions += 1
+        tmp = remaining_ticks(i)
+        if tmp > time_to_shutdown:
+            time_to_shutdown = tmp
+            longest_session = i['Id']
     info1 = {"Text": f"[INFO] The server will shut down after your episode finished", "TimeoutMS": 5000}
     info2 = {"Text": f"[INFO] The server will shut down in {int(time_to_shutdown / 600000000)} minutes.", "TimeoutMS": 5000}
-    for i in session_ids:
-        try:
-            message = info1 if i == longest_session else info2
-            requests.post(f"{jellyfin_ip}/Sessions/{i}/Message", headers=headers, json=message)
-        except KeyError:
-            continue
-    print(f"Messaged {active_sessions} session(s)!")
+    delivered, failed = notify_sessions({i['Id']: info1 if i['Id'] == longest_session else info2
+                                         for i in session_data})
+    print(f"Messaged {delivered} session(s), {failed} failed!")
     return int(time_to_shutdown / 600000000) + 1
 
-print(wakeup_time)
-minutes_left = send_message()
-print(f'Shutting down in {minutes_left} minutes')
-time.sleep(minutes_left * 60)
-print("Shutting down now!")
-
-if wakeup_time:
-    subprocess.run(['rtcwake', '-l', '--date', f'{wakeup_time}', '-m', 'mem'])
-else:
-    # put the computer to sleep, so it can be woken up by WOL
-    subprocess.run(['systemctl', 'suspend'])
\ No newline at end of file
+
+# wait for the given minutes and remind all sessions when the shutdown gets close
+def countdown(minutes: int):
+    deadline = time.monotonic() + minutes * 60
+    for notice in sorted((i for i in NOTICE_MINUTES if i < minutes), reverse=True):
+        time.sleep(max(0.0, deadline - notice * 60 - time.monotonic()))
+        notify_all(f"[INFO] The server will shut down in {notice} minute{'s' if notice != 1 else ''}.")
+    time.sleep(max(0.0, deadline - time.monotonic()))
+
+
+# the sessions as they are pushed by the server over the WebSocket, raises if the connection fails or is closed
+def websocket_sessions():
+    import websocket
+    url = jellyfin_ip.replace('http', 'ws', 1) + f"/socket?api_key={api_key}&deviceId={device}"
+    connection = websocket.create_connection(url, timeout=POLL_INTERVAL)
+    try:
+        # ask for the session list right away and then every 1.5 seconds while something changes
+        connection.send(json.dumps({"MessageType": "SessionsStart", "Data": "0,1500"}))
+        while True:
+            try:
+                message = json.loads(connection.recv())
+            except websocket.WebSocketTimeoutException:
+                # nothing happened, keep the connection alive and give the caller a chance to check the grace period
+                connection.send(json.dumps({"MessageType": "KeepAlive"}))
+                yield None
+                continue
+            if message.get('MessageType') == 'ForceKeepAlive':
+                connection.send(json.dumps({"MessageType": "KeepAlive"}))
+            elif message.get('MessageType') == 'Sessions':
+                yield message.get('Data') or []
+    finally:
+        connection.close()
+
+
+# a poll that fails is skipped with None, the server might just be busy or restarting
+def polled_sessions():
+    import requests
+    while True:
+        try:
+            sessions = get_sessions()
+        except (requests.RequestException, ValueError) as e:
+            print(f"Could not get the sessions, skipping this poll ({e})")
+            sessions = None
+        yield sessions
+        time.sleep(POLL_INTERVAL)
+
+
+# the current sessions whenever they change, None if there was no update for a while
+def session_updates():
+    try:
+        import websocket
+    except ImportError:
+        # without websocket-client the sessions are polled
+        websocket = None
+    if websocket is not None:
+        try:
+            yield from websocket_sessions()
+        except (OSError, websocket.WebSocketException) as e:
+            print(f"WebSocket not available ({e}), polling the sessions every {POLL_INTERVAL} seconds")
+    yield from polled_sessions()
+
+
+# watch the sessions until none of them has played anything for the grace period
+def wait_until_idle():
+    idle_since = None
+    last_deadline = None
+    for sessions in session_updates():
+        now = time.monotonic()
+        if sessions is not None:
+            busy = [i for i in sessions if is_busy(i)]
+            if busy:
+                idle_since = None
+                deadline = int(max(remaining_ticks(i) for i in busy) / 600000000) + 1
+                if deadline != last_deadline:
+                    print(f"{len(busy)} session(s) playing, expected to finish in {deadline} minutes")
+                    last_deadline = deadline
+            elif idle_since is None:
+                print(f"All sessions are idle, shutting down in {IDLE_GRACE} seconds if nothing is started")
+                notify_all(f"[INFO] The server will shut down in {IDLE_GRACE} seconds if nothing is played.")
+                idle_since = time.monotonic()
+        if idle_since is not None and now - idle_since >= IDLE_GRACE:
+            return
+
+
+def shutdown():
+    if wakeup_time:
+        subprocess.run(['rtcwake', '-l', '--date', f'{wakeup_time}', '-m', 'mem'])
+    else:
+        # put the computer to sleep, so it can be woken up by WOL
+        subprocess.run(['systemctl', 'suspend'])
+
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog,
+                                     description="Shut down the server once the current episodes have finished.")
+    parser.add_argument('--monitor', action='store_true',
+                        help="keep watching the sessions and shut down as soon as all of them are idle, instead of "
+                             "waiting for the episodes that play right now")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    # the report and the telemetry are written before shutting down
+    profiler.start(args)
+
+    print(wakeup_time)
+    with profiler.stage('send_message'):
+        minutes_left = send_message()
+    profiler.set('minutes_to_shutdown', minutes_left)
+    with profiler.stage('wait'):
+        if args.monitor:
+            print(f'Shutting down once all sessions are idle, expected in {minutes_left} minutes')
+            wait_until_idle()
+        else:
+            print(f'Shutting down in {minutes_left} minutes')
+            countdown(minutes_left)
+    profiler.finish()
+    print("Shutting down now!")
+    shutdown()
+
+
+if __name__ == '__main__':
+    main()
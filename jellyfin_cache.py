@@ -0,0 +1,33 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator
+from dotenv import load_dotenv
+
+# the modules with a cache read their other settings from the .env after importing this one
+load_dotenv()
+
+# directory for the local caches, caching is disabled if this is not set
+CACHE_DIR = os.getenv('CACHE_DIR')
+# seconds a connection waits for a lock on a cache, the batch modes write to the same files from several processes
+CACHE_TIMEOUT = 30
+
+
+# open a cache database and create its tables, the directory is created if it does not exist yet
+def connect(path: str, *schema: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=CACHE_TIMEOUT)
+    for statement in schema:
+        connection.execute(statement)
+    return connection
+
+
+# a connection for one read or write of a cache, the changes are committed if the block succeeds
+@contextmanager
+def open_cache(path: str, *schema: str) -> Iterator[sqlite3.Connection]:
+    connection = connect(path, *schema)
+    try:
+        with connection:
+            yield connection
+    finally:
+        connection.close()
@@ -0,0 +1,110 @@
+from __future__ import annotations
+import os
+import re
+import threading
+import time
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    import requests
+
+load_dotenv()
+
+# how often a request is repeated if the server answers with a 5xx or can't be reached
+REQUEST_RETRIES = int(os.getenv('REQUEST_RETRIES')) if os.getenv('REQUEST_RETRIES') else 3
+# seconds to wait before the first retry, doubled for every following one
+REQUEST_BACKOFF = float(os.getenv('REQUEST_BACKOFF')) if os.getenv('REQUEST_BACKOFF') else 0.5
+
+# (connect, read) timeouts in seconds, the library and the Playback Reporting queries can take a while on big servers
+DEFAULT_TIMEOUT = (5, 30)
+ENDPOINT_TIMEOUTS = {
+    '/Items': (5, 300),
+    '/Users/{id}/Items': (5, 300),
+    '/user_usage_stats/submit_custom_query': (5, 300),
+    '/Playlists': (5, 120),
+    '/Playlists/{id}/Items': (5, 60),
+    '/Playlists/{id}/Items/{id}/Move/{index}': (5, 30),
+    '/Sessions/{id}/Message': (5, 10),
+}
+
+# jellyfin ids are 32 hex characters, optionally formatted as a guid
+ID_PATTERN = re.compile(r'(?<=/)(?:[0-9a-fA-F]{32}|[0-9a-fA-F]{8}(?:-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12})(?=/|$)')
+# positions in a path, like the new index of a moved playlist entry
+INDEX_PATTERN = re.compile(r'(?<=/)\d+(?=/|$)')
+
+
+# the endpoint of a request path with the ids and query removed, used for timeouts and metrics
+def endpoint(path: str) -> str:
+    return INDEX_PATTERN.sub('{index}', ID_PATTERN.sub('{id}', urlsplit(path).path))
+
+
+# a connection pooled session to the jellyfin server with timeouts, retries and request metrics
+class JellyfinClient:
+    def __init__(self, jellyfin_ip: str, api_key: str, client: str, device: str, version: str, pool_size: int = 16,
+                 retries: int = REQUEST_RETRIES, backoff: float = REQUEST_BACKOFF):
+        self.jellyfin_ip = jellyfin_ip
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.authorization = f'MediaBrowser Client="{client}", Device="{device}", Version="{version}", ' \
+                             f'Token="{api_key}"'
+        self._session = None
+        # endpoint -> {'requests', 'errors', 'seconds', 'bytes'}
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    # the session is set up with the first request, so that scripts that only import a client don't load requests
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                session.headers['Authorization'] = self.authorization
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def _record(self, name: str, seconds: float, size: int, error: bool):
+        with self._lock:
+            metric = self.metrics.setdefault(name, {'requests': 0, 'errors': 0, 'seconds': 0.0, 'bytes': 0})
+            metric['requests'] += 1
+            metric['errors'] += error
+            metric['seconds'] += seconds
+            metric['bytes'] += size
+
+    # requests that change something on the server are only repeated if retry is set
+    def request(self, method: str, path: str, retry: bool = None, timeout=None, **kwargs) -> requests.Response:
+        import requests
+        name = endpoint(path)
+        timeout = timeout or ENDPOINT_TIMEOUTS.get(name, DEFAULT_TIMEOUT)
+        if retry is None:
+            retry = method in ('GET', 'HEAD', 'DELETE')
+        attempts = 1 + (self.retries if retry else 0)
+        for attempt in range(attempts):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, f"{self.jellyfin_ip}{path}", timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(name, time.perf_counter() - start, 0, True)
+                if attempt == attempts - 1:
+                    raise
+            else:
+                self._record(name, time.perf_counter() - start, len(response.content), response.status_code >= 400)
+                if response.status_code < 500 or attempt == attempts - 1:
+                    return response
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', path, **kwargs)
@@ -0,0 +1,210 @@
+import os
+from datetime import datetime, timedelta
+from jellyfin_cache import CACHE_DIR, connect
+from jellyfin_client import JellyfinClient
+
+# the activity is requested from a bit before the last synced row, Playback Reporting updates the play duration of a
+# row while the song is playing and rows can be written a little late
+SYNC_OVERLAP = timedelta(minutes=10)
+ACTIVITY_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+# run a query against the Playback Reporting database, returns None if the plugin is not available
+def submit_custom_query(client: JellyfinClient, query: str) -> list | None:
+    data = {'CustomQueryString': query, 'ReplaceUserId': False}
+    # the query only reads, so it is safe to repeat
+    sessions = client.post("/user_usage_stats/submit_custom_query", json=data, retry=True)
+    # check if the request was successful
+    if sessions.status_code != 200:
+        return None
+    session_data = sessions.json()
+    return session_data['results'] or []
+
+
+def audio_activity_query(user_id: str, since: str = None, days: int = None) -> str:
+    query = 'SELECT DateCreated, ItemId, PlayDuration ' \
+            'FROM PlaybackActivity ' \
+            f'WHERE UserId="{user_id}" ' \
+            'AND ItemType="Audio" '
+    if since:
+        query += f'AND DateCreated >= "{since}" '
+    if days:
+        query += f'AND DateCreated >= DATE("now", "-{days} days") '
+    return query + 'ORDER BY DateCreated DESC '
+
+
+# the audio activity of all users in one query, the rows are split up by user locally
+def all_users_audio_activity_query(since: str = None, days: int = None) -> str:
+    query = 'SELECT UserId, DateCreated, ItemId, PlayDuration ' \
+            'FROM PlaybackActivity ' \
+            'WHERE ItemType="Audio" '
+    if since:
+        query += f'AND DateCreated >= "{since}" '
+    if days:
+        query += f'AND DateCreated >= DATE("now", "-{days} days") '
+    return query + 'ORDER BY DateCreated DESC '
+
+
+# the plays of every item summed up by the server, one [ItemId, PlayCount, PlayDuration] row per item instead of
+# one row per play. Without a user id the rows of all users are returned with the UserId in front
+def audio_aggregate_query(user_id: str = None, days: int = None) -> str:
+    columns = 'ItemId, COUNT(*), SUM(PlayDuration)'
+    query = f'SELECT {columns if user_id else "UserId, " + columns} ' \
+            'FROM PlaybackActivity ' \
+            'WHERE ItemType="Audio" '
+    if user_id:
+        query += f'AND UserId="{user_id}" '
+    if days:
+        query += f'AND DateCreated >= DATE("now", "-{days} days") '
+    return query + ('GROUP BY ItemId ' if user_id else 'GROUP BY UserId, ItemId ')
+
+
+# the start of the next query for activity synced until this date
+def overlap_start(synced_until: str | None) -> str | None:
+    if synced_until is None:
+        return None
+    return (datetime.fromisoformat(synced_until[:19]) - SYNC_OVERLAP).strftime(ACTIVITY_DATE_FORMAT)
+
+
+# split [UserId, ...] rows into the listens of each of the users
+def partition_by_user(results: list, user_ids) -> dict[str, list]:
+    listens = {user_id: [] for user_id in user_ids}
+    for row in results:
+        if row[0] in listens:
+            listens[row[0]].append(row[1:])
+    return listens
+
+
+# the rows of the overlap are stored again, the play duration of a song that was still playing is updated
+UPSERT_LISTENS = 'INSERT INTO listens VALUES (?, ?, ?, ?) ON CONFLICT (user_id, date_created, item_id) DO UPDATE SET ' \
+                 'play_duration = excluded.play_duration'
+
+
+# copy of the audio playback activity, only rows newer than the last synced one minus the overlap are requested.
+# Without a cache directory the listen history is queried from the server every time
+class ListenHistory:
+    def __init__(self, path: str):
+        self.connection = connect(path, 'CREATE TABLE IF NOT EXISTS listens (user_id TEXT, date_created TEXT, '
+                                        'item_id TEXT, play_duration INTEGER, '
+                                        'PRIMARY KEY (user_id, date_created, item_id))',
+                                  # how far the activity of a user was queried, users who never play audio have no
+                                  # rows but are synced as well
+                                  'CREATE TABLE IF NOT EXISTS sync_state (user_id TEXT PRIMARY KEY, '
+                                  'synced_until TEXT)')
+
+    # the newest activity that was queried for the user, None if the user was never synced
+    def last_synced(self, user_id: str) -> str | None:
+        return self.connection.execute('SELECT MAX(value) FROM (SELECT MAX(date_created) AS value FROM listens '
+                                       'WHERE user_id = ? UNION ALL SELECT synced_until FROM sync_state '
+                                       'WHERE user_id = ?)', (user_id, user_id)).fetchone()[0]
+
+    # users with rows are synced until their own newest row. Users without any rows are marked with the newest row of
+    # the query, as far as it reached for them. The overlap of the next query picks up rows that arrive late
+    def _mark_synced(self, listens: dict[str, list], results: list):
+        if not results:
+            return
+        synced_until = results[0][1]
+        self.connection.executemany('INSERT INTO sync_state VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET '
+                                    'synced_until = MAX(synced_until, excluded.synced_until)',
+                                    ((user_id, synced_until) for user_id, rows in listens.items() if not rows))
+
+    # returns False if the Playback Reporting plugin could not be queried
+    def sync(self, client: JellyfinClient, user_id: str) -> bool:
+        results = submit_custom_query(client, audio_activity_query(user_id,
+                                                                   since=overlap_start(self.last_synced(user_id))))
+        if results is None:
+            return False
+        with self.connection:
+            self.connection.executemany(UPSERT_LISTENS,
+                                        ((user_id, row[0], row[1], int(row[2])) for row in results))
+        return True
+
+    # sync several users with a single query that starts at the user that is the furthest behind
+    def sync_users(self, client: JellyfinClient, user_ids: list) -> bool:
+        last_synced = [self.last_synced(user_id) for user_id in user_ids]
+        since = None if None in last_synced else overlap_start(min(last_synced))
+        results = submit_custom_query(client, all_users_audio_activity_query(since=since))
+        if results is None:
+            return False
+        # rows of other users are left out, storing them would move their last synced row past rows never fetched
+        listens = partition_by_user(results, user_ids)
+        with self.connection:
+            self.connection.executemany(UPSERT_LISTENS, ((user_id, row[0], row[1], int(row[2]))
+                                                         for user_id, rows in listens.items() for row in rows))
+            self._mark_synced(listens, results)
+        return True
+
+    # the listens of a user in the same shape as the query results, newest first
+    def listens(self, user_id: str, days: int = None) -> list:
+        query = 'SELECT date_created, item_id, play_duration FROM listens WHERE user_id = ? '
+        params = [user_id]
+        if days:
+            query += 'AND date_created >= DATE("now", ?) '
+            params.append(f"-{days} days")
+        rows = self.connection.execute(query + 'ORDER BY date_created DESC', params)
+        return [list(row) for row in rows]
+
+    # the listens of a user summed up per item, in the same shape as the aggregate query results
+    def item_stats(self, user_id: str, days: int = None) -> list:
+        query = 'SELECT item_id, COUNT(*), SUM(play_duration) FROM listens WHERE user_id = ? '
+        params = [user_id]
+        if days:
+            query += 'AND date_created >= DATE("now", ?) '
+            params.append(f"-{days} days")
+        rows = self.connection.execute(query + 'GROUP BY item_id', params)
+        return [list(row) for row in rows]
+
+
+# get the audio listens of a user as [DateCreated, ItemId, PlayDuration] rows, newest first,
+# from the local listen history if CACHE_DIR is set. Returns None if Playback Reporting is not available
+def load_listen_data(client: JellyfinClient, user_id: str, days: int = None) -> list | None:
+    if not CACHE_DIR:
+        return submit_custom_query(client, audio_activity_query(user_id, days=days))
+    history = ListenHistory(os.path.join(CACHE_DIR, 'history.sqlite'))
+    try:
+        if not history.sync(client, user_id):
+            return None
+        return history.listens(user_id, days)
+    finally:
+        history.connection.close()
+
+
+# the listens of several users with a single Playback Reporting query instead of one per user
+def load_listen_data_for_users(client: JellyfinClient, user_ids: list, days: int = None) -> dict[str, list] | None:
+    if not CACHE_DIR:
+        results = submit_custom_query(client, all_users_audio_activity_query(days=days))
+        return None if results is None else partition_by_user(results, user_ids)
+    history = ListenHistory(os.path.join(CACHE_DIR, 'history.sqlite'))
+    try:
+        if not history.sync_users(client, user_ids):
+            return None
+        return {user_id: history.listens(user_id, days) for user_id in user_ids}
+    finally:
+        history.connection.close()
+
+
+# get the plays of a user as one [ItemId, PlayCount, PlayDuration] row per item. The local listen history is summed
+# up if CACHE_DIR is set, otherwise the server does it. Returns None if Playback Reporting is not available
+def load_item_stats(client: JellyfinClient, user_id: str, days: int = None) -> list | None:
+    if not CACHE_DIR:
+        return submit_custom_query(client, audio_aggregate_query(user_id, days=days))
+    history = ListenHistory(os.path.join(CACHE_DIR, 'history.sqlite'))
+    try:
+        if not history.sync(client, user_id):
+            return None
+        return history.item_stats(user_id, days)
+    finally:
+        history.connection.close()
+
+
+def load_item_stats_for_users(client: JellyfinClient, user_ids: list, days: int = None) -> dict[str, list] | None:
+    if not CACHE_DIR:
+        results = submit_custom_query(client, audio_aggregate_query(days=days))
+        return None if results is None else partition_by_user(results, user_ids)
+    history = ListenHistory(os.path.join(CACHE_DIR, 'history.sqlite'))
+    try:
+        if not history.sync_users(client, user_ids):
+            return None
+        return {user_id: history.item_stats(user_id, days) for user_id in user_ids}
+    finally:
+        history.connection.close()
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from jellyfin_cache import CACHE_DIR, open_cache
+from jellyfin_client import JellyfinClient
+
+# number of image requests that run at the same time
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS')) if os.getenv('IMAGE_WORKERS') else 8
+# artist images change rarely, so they are reused for this many days
+IMAGE_CACHE_DAYS = float(os.getenv('IMAGE_CACHE_DAYS')) if os.getenv('IMAGE_CACHE_DAYS') else 30
+
+
+# downloads the primary images of items concurrently and remembers them. On disk the images are stored under the
+# hash of their content, so items that share an image only store it once. Without a cache directory the images are
+# only kept for the current run
+class ItemImages:
+    def __init__(self, client: JellyfinClient, query: str = '', workers: int = IMAGE_WORKERS,
+                 cache_dir: str = CACHE_DIR):
+        self.client = client
+        self.query = query
+        self.workers = max(1, workers)
+        self.cache_dir = os.path.join(cache_dir, 'images') if cache_dir else None
+        self.images = {}
+
+    def _open(self):
+        return open_cache(os.path.join(self.cache_dir, 'images.sqlite'),
+                          'CREATE TABLE IF NOT EXISTS images (item_id TEXT, query TEXT, digest TEXT, '
+                          'fetched_at REAL, PRIMARY KEY (item_id, query))')
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    # read the images that are still fresh from the disk cache
+    def _load(self, item_ids: list) -> dict:
+        if not self.cache_dir or not item_ids:
+            return {}
+        images = {}
+        with self._open() as connection:
+            for item_id in item_ids:
+                row = connection.execute('SELECT digest FROM images WHERE item_id = ? AND query = ? '
+                                         'AND fetched_at >= ?', (item_id, self.query,
+                                                                 time.time() - IMAGE_CACHE_DAYS * 24 * 60 * 60)
+                                         ).fetchone()
+                if row and os.path.exists(self._blob_path(row[0])):
+                    with open(self._blob_path(row[0]), 'rb') as f:
+                        images[item_id] = f.read()
+        return images
+
+    def _store(self, results: dict):
+        if not self.cache_dir:
+            return
+        with self._open() as connection:
+            fetched_at = time.time()
+            for item_id, content in results.items():
+                # items without an image are asked for again in the next run
+                if content is None:
+                    continue
+                digest = hashlib.sha256(content).hexdigest()
+                path = self._blob_path(digest)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # write to a temporary file first so that a concurrent run never reads half an image
+                    with open(f'{path}.{os.getpid()}.tmp', 'wb') as f:
+                        f.write(content)
+                    os.replace(f'{path}.{os.getpid()}.tmp', path)
+                connection.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)',
+                                   (item_id, self.query, digest, fetched_at))
+
+    def _request(self, item_id: str) -> bytes | None:
+        response = self.client.get(f"/Items/{item_id}/Images/Primary{self.query}")
+        if response.status_code != 200:
+            return None
+        return response.content
+
+    # returns the image of every item, or None for items without one. Only images that are not cached are requested
+    def get_many(self, item_ids) -> dict[str, bytes | None]:
+        item_ids = list(dict.fromkeys(item_ids))
+        self.images.update(self._load([i for i in item_ids if i not in self.images]))
+        missing = [i for i in item_ids if i not in self.images]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as executor:
+                results = dict(zip(missing, executor.map(self._request, missing)))
+            self.images.update(results)
+            self._store(results)
+        return {i: self.images[i] for i in item_ids}
+
+    def get(self, item_id: str) -> bytes | None:
+        return self.get_many([item_id])[item_id]
@@ -0,0 +1,206 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator
+import numpy as np
+import pandas as pd
+from jellyfin_cache import CACHE_DIR, connect
+from jellyfin_client import JellyfinClient
+
+# the scripts get their song frames from this module, so it is set as soon as they use pandas
+pd.options.mode.copy_on_write = True  # to avoid the SettingWithCopyWarning
+
+# number of items requested per page, 0 requests the whole library at once
+LIBRARY_PAGE_SIZE = int(os.getenv('LIBRARY_PAGE_SIZE')) if os.getenv('LIBRARY_PAGE_SIZE') else 5000
+# number of pages that are requested at the same time
+LIBRARY_FETCH_WORKERS = int(os.getenv('LIBRARY_FETCH_WORKERS')) if os.getenv('LIBRARY_FETCH_WORKERS') else 4
+# the cached library is downloaded again after this many days so that removed songs disappear from it
+LIBRARY_FULL_SYNC_DAYS = int(os.getenv('LIBRARY_FULL_SYNC_DAYS')) if os.getenv('LIBRARY_FULL_SYNC_DAYS') else 7
+# changes are requested from a bit before the last sync to not lose any to clock differences with the server
+SYNC_OVERLAP = timedelta(minutes=10)
+JELLYFIN_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+SONG_COLUMNS = ['song_name', 'play_count', 'last_played', 'path', 'album_id', 'album_artist', 'is_favorite',
+                'length', 'genre', 'artist_id']
+
+
+def _fetch_page(client: JellyfinClient, user_id: str, params: dict, start: int, limit: int) -> dict:
+    page_params = dict(params, StartIndex=start)
+    if limit:
+        page_params['Limit'] = limit
+    # without a user the items are requested without their user data
+    sessions = client.get(f"/Users/{user_id}/Items" if user_id else "/Items", params=page_params)
+    return sessions.json()
+
+
+# yields the audio items of the library page by page, with at most `workers` pages in flight at any time
+def iter_audio_items(client: JellyfinClient, user_id: str, parent_id: str = None,
+                     page_size: int = LIBRARY_PAGE_SIZE, workers: int = LIBRARY_FETCH_WORKERS,
+                     **filters) -> Iterator[dict]:
+    params = {'SortBy': 'Album,SortName', 'SortOrder': 'Ascending', 'IncludeItemTypes': 'Audio',
+              'Recursive': 'true', 'Fields': 'AudioInfo,ParentId,Path,Genres', 'ImageTypeLimit': 1, **filters}
+    if parent_id:
+        params['ParentId'] = parent_id
+
+    # the first page tells us how many items there are in total
+    first_page = _fetch_page(client, user_id, params, 0, page_size)
+    yield from first_page.get('Items', [])
+    if not page_size:
+        return
+
+    workers = max(1, workers)
+    total = first_page.get('TotalRecordCount', 0)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start in range(page_size, total, page_size):
+            pending.append(executor.submit(_fetch_page, client, user_id, params, start, page_size))
+            # hand out the oldest page before requesting more, this keeps the pages in order and the memory bounded
+            if len(pending) >= workers:
+                yield from pending.popleft().result().get('Items', [])
+        while pending:
+            yield from pending.popleft().result().get('Items', [])
+
+
+# extract the attributes of a song that the scripts work with, returns None if the item is unusable
+def parse_song(item: dict) -> tuple | None:
+    try:
+        album_id = item['AlbumId']
+    except KeyError:
+        print(f"Skipping {item['Name']}")
+        return None
+    try:
+        album_artist = item['AlbumArtist']
+        if album_artist == 'Various Artists':
+            album_artist = item['Artists'][0]
+    except (KeyError, IndexError):
+        album_artist = None
+    try:
+        artist_id = item['AlbumArtists'][0]['Id']
+    except (KeyError, IndexError):
+        artist_id = None
+    user_data = item.get('UserData', {'PlayCount': 0, 'IsFavorite': False})
+    # length in seconds
+    length = item['RunTimeTicks'] / 10000000
+    return (item['Id'], item['Name'], user_data['PlayCount'], user_data.get('LastPlayedDate'), item['Path'],
+            album_id, album_artist, user_data['IsFavorite'], length, item['Genres'], artist_id)
+
+
+# build the song table with compact dtypes: categoricals for the repeated strings, the genres joined into one
+# string, 32 bit numbers and real datetimes for the last played date
+def song_frame(ids: list, columns: dict) -> pd.DataFrame:
+    return pd.DataFrame({
+        'song_name': columns['song_name'],
+        'play_count': np.asarray(columns['play_count'], dtype=np.int32),
+        'last_played': pd.to_datetime(columns['last_played'], utc=True, format='ISO8601'),
+        'path': columns['path'],
+        'album_id': pd.Categorical(columns['album_id']),
+        'album_artist': pd.Categorical(columns['album_artist']),
+        'is_favorite': np.asarray(columns['is_favorite'], dtype=bool),
+        'length': np.asarray(columns['length'], dtype=np.float32),
+        'genre': pd.Categorical([', '.join(genre) for genre in columns['genre']]),
+        'artist_id': pd.Categorical(columns['artist_id']),
+    }, index=pd.Index(ids, dtype=object), columns=SONG_COLUMNS)
+
+
+def iter_songs(items: Iterable[dict]) -> Iterator[tuple]:
+    for item in items:
+        song = parse_song(item)
+        if song is not None:
+            yield song
+
+
+# build the song table column by column from (id, *SONG_COLUMNS) rows, indexed by the item id
+def rows_table(rows: Iterable[tuple]) -> pd.DataFrame:
+    ids = []
+    columns = [[] for _ in SONG_COLUMNS]
+    for row in rows:
+        ids.append(row[0])
+        for column, value in zip(columns, row[1:]):
+            column.append(value)
+    return song_frame(ids, dict(zip(SONG_COLUMNS, columns)))
+
+
+# build the song table while the items are streamed in
+def songs_table(items: Iterable[dict]) -> pd.DataFrame:
+    return rows_table(iter_songs(items))
+
+
+# the song table of the library without user data, shared by all users
+def load_library(client: JellyfinClient, parent_id: str = None) -> pd.DataFrame:
+    return songs_table(iter_audio_items(client, None, parent_id))
+
+
+# only the play count, last played date and favourite flag of every song for one user
+def load_user_data(client: JellyfinClient, user_id: str, parent_id: str = None) -> pd.DataFrame:
+    ids, play_count, last_played, is_favorite = [], [], [], []
+    for item in iter_audio_items(client, user_id, parent_id, Fields='', EnableImages='false'):
+        ids.append(item['Id'])
+        play_count.append(item['UserData']['PlayCount'])
+        last_played.append(item['UserData'].get('LastPlayedDate'))
+        is_favorite.append(item['UserData']['IsFavorite'])
+    return pd.DataFrame({
+        'play_count': np.asarray(play_count, dtype=np.int32),
+        'last_played': pd.to_datetime(last_played, utc=True, format='ISO8601'),
+        'is_favorite': np.asarray(is_favorite, dtype=bool),
+    }, index=pd.Index(ids, dtype=object))
+
+
+# combine the shared library with the user data of one user into that user's song table. The user data lists
+# exactly the songs the user can access, so songs of libraries the user can't see are left out
+def with_user_data(library: pd.DataFrame, user_data: pd.DataFrame) -> pd.DataFrame:
+    song_df = library.drop(columns=user_data.columns).join(user_data, how='inner')
+    return song_df[SONG_COLUMNS]
+
+
+# persistent copy of the song table that is kept up to date with the items changed since the last run
+class LibraryCache:
+    def __init__(self, path: str):
+        self.connection = connect(path, 'CREATE TABLE IF NOT EXISTS songs (scope TEXT, id TEXT, song_name TEXT, '
+                                        'play_count INTEGER, last_played TEXT, path TEXT, album_id TEXT, '
+                                        'album_artist TEXT, is_favorite INTEGER, length REAL, genre TEXT, '
+                                        'artist_id TEXT, PRIMARY KEY (scope, id))',
+                                  'CREATE TABLE IF NOT EXISTS sync_state (scope TEXT PRIMARY KEY, last_sync TEXT, '
+                                  'last_full_sync TEXT)')
+
+    def _store(self, scope: str, songs: Iterable[tuple]):
+        self.connection.executemany('INSERT OR REPLACE INTO songs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    ((scope, *song[:9], json.dumps(song[9]), song[10]) for song in songs))
+
+    def sync(self, client: JellyfinClient, user_id: str, parent_id: str = None):
+        scope = f"{user_id}/{parent_id or ''}"
+        now = datetime.now(timezone.utc)
+        state = self.connection.execute('SELECT last_sync, last_full_sync FROM sync_state WHERE scope = ?',
+                                        (scope,)).fetchone()
+        with self.connection:
+            if state is None or now - datetime.fromisoformat(state[1]) >= timedelta(days=LIBRARY_FULL_SYNC_DAYS):
+                self.connection.execute('DELETE FROM songs WHERE scope = ?', (scope,))
+                self._store(scope, iter_songs(iter_audio_items(client, user_id, parent_id)))
+                last_full_sync = now.isoformat()
+            else:
+                # changed metadata and changed user data (play count, favourites) are separate filters
+                since = (datetime.fromisoformat(state[0]) - SYNC_OVERLAP).strftime(JELLYFIN_DATE_FORMAT)
+                for date_filter in ('MinDateLastSaved', 'MinDateLastSavedForUser'):
+                    self._store(scope, iter_songs(iter_audio_items(client, user_id, parent_id, **{date_filter: since})))
+                last_full_sync = state[1]
+            self.connection.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)',
+                                    (scope, now.isoformat(), last_full_sync))
+
+    def load(self, user_id: str, parent_id: str = None) -> pd.DataFrame:
+        rows = self.connection.execute('SELECT id, song_name, play_count, last_played, path, album_id, album_artist, '
+                                       'is_favorite, length, genre, artist_id FROM songs WHERE scope = ?',
+                                       (f"{user_id}/{parent_id or ''}",))
+        return rows_table((*row[:9], json.loads(row[9]), row[10]) for row in rows)
+
+
+# get the song table of a user, from the local cache if CACHE_DIR is set
+def load_songs(client: JellyfinClient, user_id: str, parent_id: str = None) -> pd.DataFrame:
+    if not CACHE_DIR:
+        return songs_table(iter_audio_items(client, user_id, parent_id))
+    cache = LibraryCache(os.path.join(CACHE_DIR, 'library.sqlite'))
+    try:
+        cache.sync(client, user_id, parent_id)
+        return cache.load(user_id, parent_id)
+    finally:
+        cache.connection.close()
@@ -1,14 +1,24 @@
+from __future__ import annotations
+import argparse
 import datetime
 import math
+import multiprocessing
 import pickle
-import random
 import sys
-import pandas as pd
-import requests
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING
 import os
 from dotenv import load_dotenv
+from jellyfin_client import JellyfinClient
+from jellyfin_history import load_listen_data
+from jellyfin_playlist import Playlists
+from jellyfin_profile import Profiler, add_arguments
+from jellyfin_similar import SimilarItems
 
-pd.options.mode.copy_on_write = True  # to avoid the SettingWithCopyWarning
+# numpy and pandas are only imported by the functions that use them, so that starting the script stays fast
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
 load_dotenv()
 
@@ -18,13 +28,17 @@ USER_NAME = os.getenv('USER_NAME')
 PLAYLIST_LENGTH = int(os.getenv('PLAYLIST_LENGTH')) if os.getenv('PLAYLIST_LENGTH') else 6
 PLAYLIST_NAME = os.getenv('PLAYLIST_NAME') if os.getenv('PLAYLIST_NAME') else 'Daily Random Playlist'
 EXCLUDE_SONGS_UNDER = int(os.getenv('EXCLUDE_SONGS_UNDER')) if os.getenv('EXCLUDE_SONGS_UNDER') else 0
+# fixed seed for the random choices, useful to reproduce a playlist
+PLAYLIST_SEED = int(os.getenv('PLAYLIST_SEED')) if os.getenv('PLAYLIST_SEED') else None
 
 CLIENT = 'DailyPlaylistCreator'
 DEVICE = 'DailyPlaylistCreator'
 VERSION = '1.0.0'
 
-headers = {'Authorization': f'MediaBrowser Client="{CLIENT}", Device="{DEVICE}", '
-                            f'Version="{VERSION}", Token="{API_KEY}"'}
+client = JellyfinClient(JELLYFIN_IP, API_KEY, CLIENT, DEVICE, VERSION)
+similar_items = SimilarItems(client)
+playlists = Playlists(client)
+profiler = Profiler(client, 'music')
 
 
 # scoring function for the song rank
@@ -39,11 +53,22 @@ def score_function(recent_play_normal: float, total_play_count: int, days_since_
     return weights[0] * frequency + weights[1] * recency + weights[2] * high_play_decay
 
 
+# score_function applied to whole columns at once
+def score_columns(recent_play_normal: pd.Series, total_play_count: pd.Series, days_since_last_played: pd.Series,
+                  weights: tuple[float, float, float] = (0.60, 0.25, 0.15), decay_rate: float = 0.5,
+                  min_play_threshold: int = 3) -> pd.Series:
+    import numpy as np
+    frequency = recent_play_normal
+    recency = 1 / (1 + np.power(math.e, decay_rate * days_since_last_played))
+    high_play_decay = 1 / (1 + np.log(1 + total_play_count) / math.log(2))
+    score = weights[0] * frequency + weights[1] * recency + weights[2] * high_play_decay
+    return score.where(total_play_count >= min_play_threshold, 0)
+
+
 # rank the songs by the play_count and the artist play_count to get songs that have been played a lot recently
 def rank_recent(df: pd.DataFrame) -> pd.DataFrame:
-    artist_play_count = df.groupby('album_artist')['play_count'].sum()
-    artist_play_count = artist_play_count / artist_play_count.sum()
-    df['artist_play_count'] = df['album_artist'].map(artist_play_count)
+    artist_play_count = df.groupby('album_artist', observed=True)['play_count'].transform('sum')
+    df['artist_play_count'] = artist_play_count / df.loc[df['album_artist'].notna(), 'play_count'].sum()
     df['artist_play_count'] = df['artist_play_count'].fillna(0)
     df['rank'] = df['artist_play_count'] * df['play_count']
     df = df.sort_values('rank', ascending=False)
@@ -51,27 +76,26 @@ def rank_recent(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def rank_recent_by_activity(df: pd.DataFrame, list_activity: list, lookup_df) -> pd.DataFrame:
-    df['last_7_days'] = 1
-    for i in list_activity:
-        # check if the song has been played for at least 80% of the song
-        try:
-            if int(i[2]) <= lookup_df.loc[lookup_df.index == i[1], 'length'].values[0] * 0.8:
-                df.loc[df.index == i[1], 'last_7_days'] -= 1
-                continue
-        except IndexError:
-            continue
-        df.loc[df.index == i[1], 'last_7_days'] += 1
+    import numpy as np
+    import pandas as pd
+    activity = pd.DataFrame([i[:3] for i in list_activity], columns=['date_created', 'item_id', 'play_duration'])
+    # plays of songs that are no longer in the library are ignored
+    activity = activity[activity['item_id'].isin(lookup_df.index)]
+    lengths = activity['item_id'].map(lookup_df['length'])
+    # check if the song has been played for at least 80% of the song, plays below that count against the song
+    skipped = activity['play_duration'].astype(int) <= lengths * 0.8
+    plays = pd.Series(np.where(skipped, -1, 1), index=activity.index).groupby(activity['item_id']).sum()
+    df['last_7_days'] = 1 + plays.reindex(df.index, fill_value=0)
     df['last_played'] = pd.to_datetime(df['last_played'], utc=True)
     df['days_since_last_played'] = (pd.to_datetime('now', utc=True) - df['last_played']).dt.days
     max_plays_7_days = df['last_7_days'].max()
-    df['rank'] = df.apply(lambda x: score_function(x['last_7_days'] / max_plays_7_days, x['play_count'], x['days_since_last_played']),
-                          axis=1)
+    df['rank'] = score_columns(df['last_7_days'] / max_plays_7_days, df['play_count'], df['days_since_last_played'])
     df = df.sort_values('rank', ascending=False)
     return df.head(50)
 
 
 def get_users(user=None) -> dict | str:
-    sessions = requests.get(f"{JELLYFIN_IP}/Users", headers=headers)
+    sessions = client.get("/Users")
     session_data = sessions.json()
     users = {}
     for i in session_data:
@@ -81,266 +105,198 @@ def get_users(user=None) -> dict | str:
     return users
 
 
-def get_all_songs(user_id: str) -> dict:
-    request = f"{JELLYFIN_IP}/Users/{user_id}/Items?SortBy=Album,SortName&SortOrder=Ascending" \
-              f"&IncludeItemTypes=Audio&Recursive=true&Fields=AudioInfo,ParentId,Path,Genres&StartIndex=0&ImageTypeLimit=1"
-    sessions = requests.get(request, headers=headers)
-    session_data = sessions.json()
-    items = {}
-    for i in session_data.get('Items'):
-        play_count = i['UserData']['PlayCount']
-        try:
-            last_played = i['UserData']['LastPlayedDate']
-        except KeyError:
-            last_played = None
-        if 'AlbumId' not in i:
-            print("something did not work couldnt find AlbumId in:")
-            print(i)
-
-        try:
-            album_id = i['AlbumId']
-        except KeyError:
-            print(f"Skipping {i['Name']}")
-            continue
-        try:
-            album_artist = i['AlbumArtist']
-            if album_artist == 'Various Artists':
-                album_artist = i['Artists'][0]
-        except:
-            album_artist = None
-        is_favorite = i['UserData']['IsFavorite']
-        song_name = i['Name']
-        path = i['Path']
-        genre = i['Genres']
-        # length in seconds
-        length = i['RunTimeTicks'] / 10000000
-        items[i['Id']] = {'song_name': song_name, 'play_count': play_count, 'last_played': last_played, 'path': path,
-                          'album_id': album_id, 'album_artist': album_artist, 'is_favorite': is_favorite,
-                          'length': length, 'genre': genre}
-    return items
+def get_all_songs(user_id: str) -> pd.DataFrame:
+    from jellyfin_library import load_songs
+    return load_songs(client, user_id)
 
 
 # returns the listen data for all audio items
 def get_listen_data(user_id: str) -> list:
     # get all audio data
-    request = f"{JELLYFIN_IP}/user_usage_stats/submit_custom_query"
-    data = {'CustomQueryString': 'SELECT DateCreated, ItemId, PlayDuration '
-                                 'FROM PlaybackActivity '
-                                 f'WHERE UserId="{user_id}" '
-                                 f'AND ItemType="Audio" '
-                                 # f'AND DateCreated >= DATE("now", "-{days} days") '
-                                 'ORDER BY DateCreated DESC ',
-            'ReplaceUserId': False}
-    sessions = requests.post(request, headers=headers, json=data)
+    listen_data = load_listen_data(client, user_id)
     # check if the request was successful
-    if sessions.status_code != 200:
+    if listen_data is None:
         print("Playback Reporting not available. Skipping this step.")
         return []
-    session_data = sessions.json()
+    return listen_data
 
-    if not session_data['results']:
-        return []
-    return session_data['results']
+
+# map each song to the durations of its plays, in the order of the listen data (newest first)
+def build_listen_index(listen_data: list) -> dict[str, list[int]]:
+    listen_index = {}
+    for i in listen_data:
+        listen_index.setdefault(i[1], []).append(int(i[2]))
+    return listen_index
 
 
 # check if the song has been listened to for long enough to be considered as listened to
-def check_single_song(song_id: str, listen_data: list, total_length: int) -> bool:
-    if not listen_data:
-        return True
-    listen_data = [i for i in listen_data if i[1] == song_id]
-    try:
-        # get the average play duration across all plays and check if the song
-        # has been played for at least 80% of the song
-        return sum([int(i[2]) for i in listen_data]) / len(listen_data) >= total_length * 0.8
-    except IndexError:
+def check_single_song(song_id: str, listen_index: dict, total_length: int) -> bool:
+    if not listen_index:
         return True
-    except ZeroDivisionError:
+    plays = listen_index.get(song_id)
+    if not plays:
         return True
+    # get the average play duration across all plays and check if the song
+    # has been played for at least 80% of the song
+    return sum(plays) / len(plays) >= total_length * 0.8
 
 
-def check_single_song_by_skip(song_id: str, listen_data: list, total_length: int, total_plays: int) -> bool:
+def check_single_song_by_skip(song_id: str, listen_index: dict, total_length: int, total_plays: int) -> bool:
     # if the song is too short, exclude it
     if total_length < EXCLUDE_SONGS_UNDER:
         return False
 
     # if there is no listen data, assume that the song is good
-    if not listen_data:
+    if not listen_index:
         return True
 
-    listen_data = [i for i in listen_data if i[1] == song_id]
+    plays = listen_index.get(song_id)
 
-    # listen_data must exist but no entries for song means that it was skipped every time
-    if not listen_data:
+    # listen data must exist but no entries for song means that it was skipped every time
+    if not plays:
         return False
 
-    for i, p in enumerate(listen_data):
-        if min(total_length, int(p[2])) < total_length * 0.8:
-            listen_data[i] = listen_data[i] + ["skip"]
-        else:
-            listen_data[i] = listen_data[i] + ["listen"]
+    listened = [min(total_length, p) >= total_length * 0.8 for p in plays]
 
-    # assume that the list is sorted by date in descending order
+    # assume that the plays are sorted by date in descending order
     # if the user listened to it last time, they probably like it, at worst it's a false positive
-    try:
-        if (listen_data[0][3] == "listen") or (len(listen_data) < 3 and total_plays < 3):
-            return True
-    except IndexError:
+    if listened[0] or (len(listened) < 3 and total_plays < 3):
         return True
 
     # if the user skipped it last time, we have to check if they usually listen to it
     # if they skipped it the last 3 times, they probably don't like it
-    if set([i[3] for i in listen_data[:3]]) == {"skip"}:
+    if not any(listened[:3]):
         return False
 
     # return the majority of the all plays, if it's a tie, return True
-    return len([i[3] for i in listen_data if i[3] == "listen"]) > total_plays // 2
+    return sum(listened) > total_plays // 2
 
 
 def get_similar(song_id: str) -> list:
-    request = f"{JELLYFIN_IP}/Items/{song_id}/similar"
-    sessions = requests.get(request, headers=headers)
-    session_data = sessions.json()
-    similar = [i['Id'] for i in session_data.get('Items')]
-    return similar
-
-
-def random_songs_by_attribute(song_df: pd.DataFrame, attribute: str, a: int, b: int) -> list:
-    # get the artists of daily_playlist_items and for each one get a-b songs randomly
-    selected_songs = []
-    artists = song_df.loc[:, attribute].unique()
-    try:
-        for artist in artists:
-            attribute_songs = song_df[song_df[attribute] == artist].index
-            if len(attribute_songs) < a:
-                selected_songs.extend(attribute_songs)
-                continue
-            selected_songs.extend([random.choice(attribute_songs) for _ in range(random.randint(a, b))])
-    except KeyError:
-        pass
-    return selected_songs
-
-
-def random_songs_by_play_count(song_df: pd.DataFrame, min_play_count: int, max_play_count: int, a: int, b: int) -> list:
-    try:
-        rest_songs = song_df[(song_df['play_count'] > min_play_count) & (song_df['play_count'] < max_play_count)].index
-        return [random.choice(rest_songs) for _ in range(random.randint(a, b))]
-    except KeyError:
-        return []
+    return similar_items.get(song_id)
 
 
-def random_stuffing(daily_playlist_items: list, extra: int = 5) -> list:
+def random_stuffing(daily_playlist_items: list, extra: int = 5, rng: np.random.Generator = None) -> list:
+    import numpy as np
+    rng = rng if rng is not None else np.random.default_rng()
     # just add some similar songs from a random song in the playlist
-    return get_similar(random.choice(daily_playlist_items[:min(10, len(daily_playlist_items))]))[:extra]
+    return get_similar(daily_playlist_items[rng.integers(min(10, len(daily_playlist_items)))])[:extra]
 
 
-def culminate_potential_songs(song_df: pd.DataFrame, listen_data: list) -> list:
+def culminate_potential_songs(song_df: pd.DataFrame, listen_data: list, rng: np.random.Generator = None) -> list:
+    import numpy as np
+    from jellyfin_sampling import SongSampler
+    rng = rng if rng is not None else np.random.default_rng()
     daily_playlist_items = []
-    # convert date to datetime
-    song_df.loc[:, 'last_played'] = pd.to_datetime(song_df.loc[:, 'last_played'])
 
     df = song_df.sort_values('last_played', ascending=False)
     top_latest = rank_recent_by_activity(df.head(100), listen_data, df) if listen_data else rank_recent(df.head(100))
+    sampler = SongSampler(df, rng)
 
     # i dont know why but sample doesn't work when there are less nonzero values than n
     top_latest_nonzero = top_latest[top_latest['rank'] > 0]
     sample_size = min(20, len(top_latest_nonzero))
     # add 10 songs from the top_latest to daily_playlist_items with weights where weights are the rank
-    daily_playlist_items.extend(top_latest.sample(n=sample_size, weights='rank').index)
+    daily_playlist_items.extend(top_latest.sample(n=sample_size, weights='rank', random_state=rng).index)
 
     similars = []
     # for each song in daily_playlist_items, get 3 similar songs, this is probably lighter than doing it for 50 songs
+    # the similar items are not limited to the songs the user can access, so the others are left out
+    similar = similar_items.get_many(top_latest.index)
     for i in top_latest.index:
-        similar = get_similar(i)
-        similars.extend(similar[:3])
+        similars.extend([j for j in similar[i] if j in df.index][:3])
     daily_playlist_items.extend(similars)
 
     # for the five best artists, get at max 5 songs as the other songs will likely come by the other methods
-    top_artists = top_latest['album_artist'].value_counts().head(5).index
-    for artist in top_artists:
-        artist_songs = df[df['album_artist'] == artist].index
-        daily_playlist_items.extend([random.choice(artist_songs) for _ in range(random.randint(3, 5))])
+    artist_counts = top_latest['album_artist'].value_counts()
+    top_artists = artist_counts[artist_counts > 0].head(5).index
+    daily_playlist_items.extend(sampler.from_values('album_artist', top_artists, 3, 5))
 
     # add 5-8 random songs from top_latest to daily_playlist_items
-    daily_playlist_items.extend([random.choice(top_latest.index) for _ in range(random.randint(5, 8))])
+    daily_playlist_items.extend(sampler.choice(sampler.positions(top_latest.index), 5, 8))
 
     # get 0 - 5 random songs from the favourites
-    try:
-        favourites = df[df['is_favorite']].index
-        daily_playlist_items.extend([random.choice(favourites) for _ in range(random.randint(0,
-                                                                                             min(len(favourites), 5)))])
-    except KeyError:
-        pass
+    daily_playlist_items.extend(sampler.choice(sampler.favourites, 0, min(len(sampler.favourites), 5)))
 
     # some issue with the daily_playlist_items, so we need to get the working keys
     relevant_ids = df.index.intersection(daily_playlist_items)
-    attribute_df = df.loc[relevant_ids]
+    attribute_sampler = SongSampler(df.loc[relevant_ids], rng)
 
     # for each artist in daily_playlist_items, get 7-10 songs randomly
-    daily_playlist_items.extend(random_songs_by_attribute(attribute_df, 'album_artist', 7, 10))
+    daily_playlist_items.extend(attribute_sampler.by_attribute('album_artist', 7, 10))
 
     # for each album in daily_playlist_items, get 7-10 songs randomly
-    daily_playlist_items.extend(random_songs_by_attribute(attribute_df, 'album_id', 7, 10))
+    daily_playlist_items.extend(attribute_sampler.by_attribute('album_id', 7, 10))
 
     # get 10-15 random songs from the rest of the songs where play_count > 3
-    daily_playlist_items.extend(random_songs_by_play_count(df, 3, 99, 10, 15))
+    daily_playlist_items.extend(sampler.by_play_count(3, 99, 10, 15))
 
     # get 5-10 random songs from the rest of the songs where play_count <= 3
-    daily_playlist_items.extend(random_songs_by_play_count(df, -1, 4, 5, 10))
+    daily_playlist_items.extend(sampler.by_play_count(-1, 4, 5, 10))
 
     # mix the daily_playlist_items while retaining the order of the first 10 songs
-    try:
-        daily_playlist_items = daily_playlist_items[:20] + random.sample(daily_playlist_items[20:],
-                                                                         len(daily_playlist_items) - 20)
-    except ValueError:
-        pass
+    rest = daily_playlist_items[20:]
+    daily_playlist_items = daily_playlist_items[:20] + [rest[i] for i in rng.permutation(len(rest))]
 
     print(f"Playlist has {len(daily_playlist_items)} items before pruning.")
     return daily_playlist_items
 
 
 # remove songs that are duplicated or probably unfit for the playlist
-def prune_playlist(song_df: pd.DataFrame, listen_data: list, daily_playlist_items: list, length: int) -> list:
+def prune_playlist(song_df: pd.DataFrame, listen_data: list, daily_playlist_items: list, length: int,
+                   rng: np.random.Generator = None) -> list:
+    import numpy as np
 
-    # check and remove duplicates without using set to retain order
-    daily_playlist_items = [i for n, i in enumerate(daily_playlist_items) if i not in daily_playlist_items[:n]]
+    # check and remove duplicates, dict keys retain the order
+    daily_playlist_items = list(dict.fromkeys(daily_playlist_items))
 
-    if listen_data:
-        to_remove = []
+    listen_index = build_listen_index(listen_data)
+    if listen_index:
+        to_remove = set()
         for i in daily_playlist_items[:20]:
             if song_df.loc[i, 'play_count'] < 1:
                 continue
-            if not check_single_song_by_skip(i, listen_data, song_df.loc[i, 'length'], song_df.loc[i, 'play_count']):
-                to_remove.append(i)
+            if not check_single_song_by_skip(i, listen_index, song_df.loc[i, 'length'], song_df.loc[i, 'play_count']):
+                to_remove.add(i)
         daily_playlist_items = [i for i in daily_playlist_items if i not in to_remove]
 
-    # limit or stuff the playlist to 6 hours
-    playlist_length = sum([song_df.loc[i, 'length'] for i in daily_playlist_items])
+    # limit or stuff the playlist to 6 hours, the length is kept as a running total
+    lengths = song_df['length']
+    playlist_length = lengths.loc[daily_playlist_items].sum()
+    in_playlist = set(daily_playlist_items)
 
     # if the playlist is too short, add more songs that are similar to the first few
+    # the songs for the stuffing are picked from the first 10, so their similar items are all requested at once
+    similar_items.get_many(daily_playlist_items[:10])
     extension_constant = 5
     while playlist_length < length:
-        stuff_songs = random_stuffing(daily_playlist_items, extension_constant)
-        stuff_songs = [x for x in stuff_songs if x not in daily_playlist_items and x in song_df.index]
+        stuff_songs = random_stuffing(daily_playlist_items, extension_constant, rng)
+        stuff_songs = [x for x in stuff_songs if x not in in_playlist and x in song_df.index]
 
-        if listen_data:
-            stuff_songs = [i for i in stuff_songs if check_single_song_by_skip(i, listen_data, song_df.loc[i, 'length'],
+        if listen_index:
+            stuff_songs = [i for i in stuff_songs if check_single_song_by_skip(i, listen_index, song_df.loc[i, 'length'],
                                                                                song_df.loc[i, 'play_count'])]
         daily_playlist_items.extend(stuff_songs)
-        playlist_length = sum([song_df.loc[i, 'length'] for i in daily_playlist_items])
+        in_playlist.update(stuff_songs)
+        playlist_length += lengths.loc[stuff_songs].sum()
         extension_constant += 1
 
-    # if the playlist is too long, remove the last songs
-    while playlist_length > length:
-        # remove the last song
-        daily_playlist_items.pop()
-        playlist_length = sum([song_df.loc[i, 'length'] for i in daily_playlist_items])
+    # if the playlist is too long, cut it after the last song that still fits
+    cumulative_length = lengths.loc[daily_playlist_items].cumsum().to_numpy()
+    keep = int(np.searchsorted(cumulative_length, length, side='right'))
+    daily_playlist_items = daily_playlist_items[:keep]
+    playlist_length = cumulative_length[keep - 1] if keep else 0
 
     print(
         f"Final playlist has {len(daily_playlist_items)} items and is {playlist_length / 60 / 60:.2f} hours long.")
     return daily_playlist_items
 
 
-def create_random_playlist(song_df: pd.DataFrame, listen_data: list, recency: int = 7, length: int = 360000) -> list:
+def create_random_playlist(song_df: pd.DataFrame, listen_data: list, recency: int = 7, length: int = 360000,
+                           seed: int = None) -> list:
+    import numpy as np
+    # one seedable generator for all random choices, so that a playlist can be reproduced
+    rng = np.random.default_rng(seed)
     # extract the last n days of listen data
     n_days_ago = datetime.datetime.now() - datetime.timedelta(days=recency)
     # remove the microseconds because I'm not dealing with this garbage
@@ -353,54 +309,151 @@ def create_random_playlist(song_df: pd.DataFrame, listen_data: list, recency: in
         except IndexError:
             recent_listen_data = []
 
-    daily_playlist_items = culminate_potential_songs(song_df, recent_listen_data)
+    with profiler.stage('culminate_potential_songs') as stage:
+        daily_playlist_items = culminate_potential_songs(song_df, recent_listen_data, rng)
+        stage['rows'] = len(daily_playlist_items)
     # pruning the list
-    daily_playlist_items = prune_playlist(song_df, listen_data, daily_playlist_items, length)
+    with profiler.stage('prune_playlist') as stage:
+        daily_playlist_items = prune_playlist(song_df, listen_data, daily_playlist_items, length, rng)
+        stage['rows'] = len(daily_playlist_items)
     return daily_playlist_items
 
 
 def create_jellyfin_playlist(user_id: str, playlist_name: str, playlist_items: list) -> int:
     # get all playlists and filter for the playlist_name, if it exists, delete it
-    request = f"{JELLYFIN_IP}/Users/{user_id}/Items?IncludeItemTypes=Playlist&Recursive=true"
-    sessions = requests.get(request, headers=headers)
+    sessions = client.get(f"/Users/{user_id}/Items?IncludeItemTypes=Playlist&Recursive=true")
     session_data = sessions.json()
     for i in session_data['Items']:
         if i['Name'] == playlist_name:
             print("Playlist exists, deleting it")
-            request = f"{JELLYFIN_IP}/Items/{i['Id']}"
-            sessions = requests.delete(request, headers=headers)
+            sessions = client.delete(f"/Items/{i['Id']}")
             if sessions.status_code != 204:
                 print("Error deleting playlist:", sessions.status_code)
                 return sessions.status_code
 
-    request = f"{JELLYFIN_IP}/Playlists"
     data = {
         "Name": playlist_name,
         "Ids": playlist_items,
         "UserId": user_id,
     }
-    sessions = requests.post(request, headers=headers, json=data)
+    sessions = client.post("/Playlists", json=data)
     # return response code
     return sessions.status_code
 
 
-if __name__ == '__main__':
-    if not API_KEY or not JELLYFIN_IP or not USER_NAME:
+# change the entries of the existing playlist instead of replacing it
+def update_jellyfin_playlist(user_id: str, playlist_name: str, playlist_items: list) -> int:
+    return playlists.update(user_id, playlist_name, playlist_items)
+
+
+# build the playlists of several users at once: the library is fetched once, the user data and listen data of all
+# users in parallel, and the playlists are built in a pool of processes
+def create_playlists_for_users(user_names: list = None, workers: int = None, update: bool = False):
+    from jellyfin_library import load_library, load_user_data, with_user_data
+    users = get_users()
+    if user_names:
+        users = {user_id: name for user_id, name in users.items() if name in user_names}
+    library = load_library(client)
+    with ThreadPoolExecutor() as executor:
+        user_data = dict(zip(users, executor.map(lambda user_id: load_user_data(client, user_id), users)))
+        listen_data = dict(zip(users, executor.map(get_listen_data, users)))
+    profiler.set('library_songs', len(library))
+    profiler.set('listen_rows', sum(len(i) for i in listen_data.values()))
+
+    # spawn fresh processes instead of forking the open connections of this one
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(create_random_playlist, with_user_data(library, user_data[user_id]),
+                                   listen_data[user_id], 7, PLAYLIST_LENGTH * 60 * 60, PLAYLIST_SEED): user_id
+                   for user_id in users}
+        playlist_items, playlist_seconds, failed = 0, 0.0, 0
+        for future in as_completed(futures):
+            user_id = futures[future]
+            # one user whose playlist can't be built or sent must not stop the playlists of the others
+            try:
+                playlist = future.result()
+                if update:
+                    playlist_status = update_jellyfin_playlist(user_id, PLAYLIST_NAME, playlist)
+                else:
+                    playlist_status = create_jellyfin_playlist(user_id, PLAYLIST_NAME, playlist)
+            except Exception as e:
+                failed += 1
+                print(f"Playlist {'update' if update else 'creation'} for {users[user_id]} failed: "
+                      f"{type(e).__name__}: {e}")
+                continue
+            playlist_items += len(playlist)
+            playlist_seconds += float(library.loc[playlist, 'length'].sum())
+            if playlist_status < 300:
+                print(f"Playlist for {users[user_id]} {'updated' if update else 'created'} successfully:",
+                      playlist_status)
+            else:
+                failed += 1
+                print(f"Playlist {'update' if update else 'creation'} for {users[user_id]} failed:", playlist_status)
+    profiler.set('playlists', len(users))
+    profiler.set('playlists_failed', failed)
+    profiler.set('playlist_items', playlist_items)
+    profiler.set('playlist_hours', playlist_seconds / 60 / 60)
+
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog,
+                                     description="Create a random daily playlist based on the recent listen history.")
+    parser.add_argument('--users', nargs='+', metavar='NAME',
+                        help="create the playlists of these users instead of USER_NAME in one batch")
+    parser.add_argument('--all-users', action='store_true', help="create the playlists of all users in one batch")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of processes that build playlists in batch mode, defaults to the CPU count")
+    parser.add_argument('--update', action='store_true',
+                        help="change the songs of the existing playlist instead of deleting and creating it again")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    batch = args.users or args.all_users
+
+    if not API_KEY or not JELLYFIN_IP or not (USER_NAME or batch):
         print("Please set the API_KEY, JELLYFIN_IP and USER_NAME environment variables.\nTo do this, make a copy of the"
               ".example.env file in the same directory as this script and fill it in with your values. "
               "Then rename it to .env.")
         sys.exit(1)
+
+    profiler.start(args)
+
+    if batch:
+        # the playlists are built in other processes, their stages are part of create_playlists
+        with profiler.stage('create_playlists'):
+            create_playlists_for_users(args.users, args.workers, args.update)
+        profiler.finish()
+        sys.exit(0)
+
     # acquire necessary data
-    user_id = get_users(USER_NAME)
-    song_data = get_all_songs(user_id)
-    listen_data = get_listen_data(user_id)
+    with profiler.stage('get_users'):
+        user_id = get_users(USER_NAME)
+    with profiler.stage('get_all_songs') as stage:
+        song_data = get_all_songs(user_id)
+        stage['rows'] = len(song_data)
+    with profiler.stage('get_listen_data') as stage:
+        listen_data = get_listen_data(user_id)
+        stage['rows'] = len(listen_data)
+    profiler.set('library_songs', len(song_data))
+    profiler.set('listen_rows', len(listen_data))
     # pickle.dump(song_data, open('example_song_data.pkl', 'wb'))
     # song_data = pickle.load(open('example_song_data.pkl', 'rb'))
 
     # create the playlist
-    playlist = create_random_playlist(pd.DataFrame(song_data).T, listen_data, 7, PLAYLIST_LENGTH * 60 * 60)
-    playlist_status = create_jellyfin_playlist(user_id, PLAYLIST_NAME, playlist)
-    if playlist_status == 200:
-        print("Playlist created successfully:", playlist_status)
+    playlist = create_random_playlist(song_data, listen_data, 7, PLAYLIST_LENGTH * 60 * 60, PLAYLIST_SEED)
+    with profiler.stage('create_jellyfin_playlist') as stage:
+        if args.update:
+            playlist_status = update_jellyfin_playlist(user_id, PLAYLIST_NAME, playlist)
+        else:
+            playlist_status = create_jellyfin_playlist(user_id, PLAYLIST_NAME, playlist)
+        stage['rows'] = len(playlist)
+    profiler.set('playlist_items', len(playlist))
+    profiler.set('playlist_hours', float(song_data.loc[playlist, 'length'].sum()) / 60 / 60)
+    profiler.set('playlist_status', playlist_status)
+    if playlist_status < 300:
+        print(f"Playlist {'updated' if args.update else 'created'} successfully:", playlist_status)
     else:
-        print("Playlist creation failed:", playlist_status)
+        print(f"Playlist {'update' if args.update else 'creation'} failed:", playlist_status)
+    profiler.finish()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+import bisect
+import os
+from collections import Counter
+from jellyfin_cache import CACHE_DIR, open_cache
+from jellyfin_client import JellyfinClient
+
+# number of songs added or removed with one request, long lists of ids make slow requests and urls that are too long
+PLAYLIST_CHUNK_SIZE = int(os.getenv('PLAYLIST_CHUNK_SIZE')) if os.getenv('PLAYLIST_CHUNK_SIZE') else 100
+
+
+def chunks(items: list, size: int) -> list:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# the index in the new list of every song in the playlist, a song that is in the list twice gets both indexes in order
+def target_order(playlist_items: list, item_ids: list) -> list:
+    targets = {}
+    for index, item_id in enumerate(item_ids):
+        targets.setdefault(item_id, []).append(index)
+    return [targets[item_id].pop(0) for item_id in playlist_items]
+
+
+# positions of one longest increasing subsequence of the values, these entries can stay while the others are moved
+def longest_increasing(values: list) -> set:
+    tails, tail_positions, previous = [], [], []
+    for position, value in enumerate(values):
+        i = bisect.bisect_left(tails, value)
+        tails[i:i + 1] = [value]
+        tail_positions[i:i + 1] = [position]
+        previous.append(tail_positions[i - 1] if i else None)
+    kept = set()
+    position = tail_positions[-1] if tail_positions else None
+    while position is not None:
+        kept.add(position)
+        position = previous[position]
+    return kept
+
+
+# keeps playlists up to date by changing their entries instead of deleting and creating them again, so the playlist
+# keeps its id and clients that show it are not broken. The ids of the playlists are remembered in the cache, without
+# a cache directory they are looked up by name every run
+class Playlists:
+    def __init__(self, client: JellyfinClient, chunk_size: int = PLAYLIST_CHUNK_SIZE, cache_dir: str = CACHE_DIR):
+        self.client = client
+        self.chunk_size = max(1, chunk_size)
+        self.cache_path = os.path.join(cache_dir, 'playlists.sqlite') if cache_dir else None
+        self.ids = {}
+
+    def _open(self):
+        return open_cache(self.cache_path, 'CREATE TABLE IF NOT EXISTS playlists (user_id TEXT, name TEXT, '
+                                           'playlist_id TEXT, PRIMARY KEY (user_id, name))')
+
+    def _cached_id(self, user_id: str, name: str) -> str | None:
+        if (user_id, name) in self.ids or not self.cache_path:
+            return self.ids.get((user_id, name))
+        with self._open() as connection:
+            row = connection.execute('SELECT playlist_id FROM playlists WHERE user_id = ? AND name = ?',
+                                     (user_id, name)).fetchone()
+        return row[0] if row else None
+
+    # remember the id of a playlist, None forgets it
+    def _store_id(self, user_id: str, name: str, playlist_id: str | None):
+        self.ids[(user_id, name)] = playlist_id
+        if not self.cache_path:
+            return
+        with self._open() as connection:
+            if playlist_id is None:
+                connection.execute('DELETE FROM playlists WHERE user_id = ? AND name = ?', (user_id, name))
+            else:
+                connection.execute('INSERT OR REPLACE INTO playlists VALUES (?, ?, ?)', (user_id, name, playlist_id))
+
+    # the id of the playlist of the user with this name, None if there is none
+    def find(self, user_id: str, name: str) -> str | None:
+        sessions = self.client.get(f"/Users/{user_id}/Items?IncludeItemTypes=Playlist&Recursive=true")
+        for i in sessions.json()['Items']:
+            if i['Name'] == name:
+                return i['Id']
+        return None
+
+    # the songs of the playlist in their order with the ids of their entries, None if the playlist does not exist
+    def entries(self, playlist_id: str, user_id: str) -> list[tuple[str, str]] | None:
+        sessions = self.client.get(f"/Playlists/{playlist_id}/Items?UserId={user_id}")
+        if sessions.status_code == 404:
+            return None
+        sessions.raise_for_status()
+        return [(i['Id'], i['PlaylistItemId']) for i in sessions.json()['Items']]
+
+    # add the songs to the end of the playlist, returns the status of the first request that failed or of the last one
+    def add(self, playlist_id: str, user_id: str, item_ids: list) -> int:
+        status = 204
+        for chunk in chunks(item_ids, self.chunk_size):
+            status = self.client.post(f"/Playlists/{playlist_id}/Items?Ids={','.join(chunk)}&UserId={user_id}")\
+                .status_code
+            if status >= 300:
+                return status
+        return status
+
+    def remove(self, playlist_id: str, entry_ids: list) -> int:
+        status = 204
+        for chunk in chunks(entry_ids, self.chunk_size):
+            status = self.client.delete(f"/Playlists/{playlist_id}/Items?EntryIds={','.join(chunk)}").status_code
+            if status >= 300:
+                return status
+        return status
+
+    # a new playlist is created with the first chunk of songs, the others are added to it
+    def create(self, user_id: str, name: str, item_ids: list) -> int:
+        data = {
+            "Name": name,
+            "Ids": item_ids[:self.chunk_size],
+            "UserId": user_id,
+        }
+        sessions = self.client.post("/Playlists", json=data)
+        if sessions.status_code >= 300:
+            return sessions.status_code
+        playlist_id = sessions.json()['Id']
+        self._store_id(user_id, name, playlist_id)
+        status = self.add(playlist_id, user_id, item_ids[self.chunk_size:])
+        return sessions.status_code if status < 300 else status
+
+    # the number of requests that add or remove this many songs
+    def _requests(self, *counts: int) -> int:
+        return sum(-(-count // self.chunk_size) for count in counts)
+
+    # move the entry to the new index, the index counts the entries without the moved one
+    def move(self, playlist_id: str, entry_id: str, index: int) -> int:
+        return self.client.post(f"/Playlists/{playlist_id}/Items/{entry_id}/Move/{index}").status_code
+
+    # put the entries into the order of the songs with as few moves as possible. The entries that are already in
+    # the right order relative to each other stay, every other one is moved right behind its predecessor
+    def reorder(self, playlist_id: str, current: list[tuple[str, str]], item_ids: list) -> tuple[int, int]:
+        order = target_order([item_id for item_id, _ in current], item_ids)
+        entries = [entry_id for _, entry_id in current]
+        by_index = dict(zip(order, entries))
+        placed = {entries[i] for i in longest_increasing(order)}
+        moves = 0
+        for index in range(len(item_ids)):
+            entry_id = by_index[index]
+            if entry_id in placed:
+                continue
+            entries.remove(entry_id)
+            new_index = entries.index(by_index[index - 1]) + 1 if index else 0
+            entries.insert(new_index, entry_id)
+            placed.add(entry_id)
+            status = self.move(playlist_id, entry_id, new_index)
+            if status >= 300:
+                return status, moves
+            moves += 1
+        return 204, moves
+
+    # make the playlist hold exactly these songs in this order. Only the entries of songs that are not in the new
+    # list are removed and only the songs that are not in the playlist yet are added, then the entries are moved into
+    # the new order. Every move is a request of its own, so if that takes more requests than removing all entries
+    # and adding the songs again in their order, the entries are replaced instead. The playlist keeps its id either way
+    def update(self, user_id: str, name: str, item_ids: list) -> int:
+        playlist_id = self._cached_id(user_id, name)
+        current = self.entries(playlist_id, user_id) if playlist_id else None
+        if current is None:
+            # not cached or deleted on the server since, it might still exist under another id
+            playlist_id = self.find(user_id, name)
+            if playlist_id is None:
+                print("Playlist does not exist, creating it")
+                return self.create(user_id, name, item_ids)
+            self._store_id(user_id, name, playlist_id)
+            current = self.entries(playlist_id, user_id) or []
+
+        # a song can be in the list more than once, so the entries are matched by their count
+        missing = Counter(item_ids)
+        removed = []
+        for item_id, entry_id in current:
+            if missing[item_id] > 0:
+                missing[item_id] -= 1
+            else:
+                removed.append(entry_id)
+        added = []
+        for item_id in item_ids:
+            if missing[item_id] > 0:
+                missing[item_id] -= 1
+                added.append(item_id)
+
+        # the new entries are added at the end, the moves that are needed from there can be counted in advance
+        removed_ids = set(removed)
+        order = target_order([item_id for item_id, entry_id in current if entry_id not in removed_ids] + added,
+                             item_ids)
+        moves = len(order) - len(longest_increasing(order))
+        if self._requests(len(current), len(item_ids)) < \
+                self._requests(len(removed), len(added)) + (1 + moves if moves else 0):
+            print(f"Replacing the {len(current)} songs of the playlist, {moves} moves would take more requests")
+            status = self.remove(playlist_id, [entry_id for _, entry_id in current])
+            if status >= 300:
+                return status
+            return self.add(playlist_id, user_id, item_ids)
+        print(f"Updating the playlist: keeping {len(current) - len(removed)} songs, removing {len(removed)} and "
+              f"adding {len(added)}")
+        status = self.remove(playlist_id, removed)
+        if status >= 300:
+            return status
+        status = self.add(playlist_id, user_id, added)
+        if status >= 300:
+            return status
+
+        # the ids of the added entries are only known from the server
+        current = self.entries(playlist_id, user_id) or []
+        if [item_id for item_id, _ in current] == list(item_ids):
+            return status
+        if sorted(item_id for item_id, _ in current) != sorted(item_ids):
+            print("The playlist was changed on the server while updating it, its order is not fixed")
+            return status
+        status, moves = self.reorder(playlist_id, current, item_ids)
+        print(f"Moved {moves} songs into the new order")
+        return status
@@ -0,0 +1,210 @@
+import argparse
+import cProfile
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from jellyfin_client import JellyfinClient
+
+load_dotenv()
+
+# files the run telemetry is written to, can also be given on the command line
+TELEMETRY_JSONL = os.getenv('TELEMETRY_JSONL')
+TELEMETRY_TEXTFILE = os.getenv('TELEMETRY_TEXTFILE')
+
+
+# the --profile and telemetry options that every script has
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--profile', nargs='?', const='', metavar='PSTATS_FILE',
+                        help="print the time, http requests and rows of every stage, and write cProfile stats to "
+                             "PSTATS_FILE if it is given")
+    parser.add_argument('--telemetry-jsonl', default=TELEMETRY_JSONL, metavar='FILE',
+                        help="append a json record of the run to this file")
+    parser.add_argument('--telemetry-textfile', default=TELEMETRY_TEXTFILE, metavar='FILE',
+                        help="write the metrics of the run to this file for the Prometheus textfile collector")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+# collects the wall time, cpu time, http traffic and row counts of the stages of a script, and values like the
+# library size. A disabled profiler only passes through, so the stages can stay in the code
+class Profiler:
+    def __init__(self, client: JellyfinClient = None, script: str = ''):
+        self.client = client
+        self.script = script
+        self.enabled = False
+        self.print_report = False
+        self.pstats_path = None
+        self.jsonl_path = None
+        self.textfile_path = None
+        self.stages = []
+        self.values = {}
+        self._cprofile = None
+        self._start = None
+        self._started_at = None
+
+    # pstats_path also records every function call with cProfile and writes the stats there
+    def enable(self, pstats_path: str = None, print_report: bool = True):
+        self.enabled = True
+        self.print_report = print_report
+        self.pstats_path = pstats_path
+        if pstats_path:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._start = (time.perf_counter(), time.process_time(), self._http())
+        self._started_at = datetime.now(timezone.utc)
+
+    # enable the profiler for the options of add_arguments
+    def start(self, args: argparse.Namespace):
+        self.jsonl_path = args.telemetry_jsonl
+        self.textfile_path = args.telemetry_textfile
+        if args.profile is not None or self.jsonl_path or self.textfile_path:
+            self.enable(args.profile or None, print_report=args.profile is not None)
+
+    def _http(self) -> tuple[int, int, float]:
+        if self.client is None:
+            return 0, 0, 0.0
+        metrics = list(self.client.metrics.values())
+        return (sum(i['requests'] for i in metrics), sum(i['bytes'] for i in metrics),
+                sum(i['seconds'] for i in metrics))
+
+    def _measure(self, name: str, start: tuple, rows: int | None) -> dict:
+        wall, cpu, http = start
+        requests, size, seconds = self._http()
+        return {'name': name, 'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu,
+                'requests': requests - http[0], 'bytes': size - http[1], 'http': seconds - http[2], 'rows': rows}
+
+    # time a stage, the rows it produced can be set on the yielded dict: `stage['rows'] = len(songs)`
+    @contextmanager
+    def stage(self, name: str):
+        record = {'rows': None}
+        if not self.enabled:
+            yield record
+            return
+        start = (time.perf_counter(), time.process_time(), self._http())
+        try:
+            yield record
+        finally:
+            self.stages.append(self._measure(name, start, record['rows']))
+
+    # a number that describes the run, e.g. the library size or the length of the playlist
+    def set(self, name: str, value: float):
+        if self.enabled:
+            self.values[name] = value
+
+    # add to a value, for the ones that are counted over several users
+    def add(self, name: str, value: float):
+        if self.enabled:
+            self.values[name] = self.values.get(name, 0) + value
+
+    # stages that ran several times, e.g. once per user, are summed up
+    def merged_stages(self) -> dict[str, dict]:
+        stages = {}
+        for stage in self.stages:
+            if stage['name'] not in stages:
+                stages[stage['name']] = dict(stage)
+                continue
+            merged = stages[stage['name']]
+            for key in ('wall', 'cpu', 'requests', 'bytes', 'http'):
+                merged[key] += stage[key]
+            if stage['rows'] is not None:
+                merged['rows'] = (merged['rows'] or 0) + stage['rows']
+        return stages
+
+    def report(self):
+        total = self._measure('total', self._start, None)
+        print(f"\n{'stage':<28} {'wall s':>8} {'cpu s':>8} {'requests':>9} {'http s':>8} {'MB':>8} {'rows':>9}")
+        for stage in list(self.merged_stages().values()) + [total]:
+            rows = '' if stage['rows'] is None else stage['rows']
+            print(f"{stage['name']:<28} {stage['wall']:>8.3f} {stage['cpu']:>8.3f} {stage['requests']:>9} "
+                  f"{stage['http']:>8.3f} {stage['bytes'] / 1e6:>8.2f} {rows:>9}")
+        if self.client is not None and self.client.metrics:
+            print(f"\n{'endpoint':<40} {'requests':>9} {'errors':>7} {'total s':>8} {'avg ms':>8} {'MB':>8}")
+            for name, metric in sorted(self.client.metrics.items(), key=lambda i: -i[1]['seconds']):
+                print(f"{name:<40} {metric['requests']:>9} {metric['errors']:>7} {metric['seconds']:>8.3f} "
+                      f"{metric['seconds'] / metric['requests'] * 1000:>8.1f} {metric['bytes'] / 1e6:>8.2f}")
+        if self.pstats_path:
+            print(f"\ncProfile stats written to {self.pstats_path}, view them with `python -m pstats "
+                  f"{self.pstats_path}`")
+
+    # everything that was measured in the run as one json serializable dict
+    def run_record(self) -> dict:
+        total = self._measure('total', self._start, None)
+        return {
+            'script': self.script,
+            'started_at': self._started_at.isoformat(),
+            'duration_seconds': total['wall'],
+            'cpu_seconds': total['cpu'],
+            'stages': {name: {key: value for key, value in stage.items() if key != 'name'}
+                       for name, stage in self.merged_stages().items()},
+            'endpoints': dict(self.client.metrics) if self.client is not None else {},
+            'values': self.values,
+        }
+
+    def write_jsonl(self, path: str, record: dict):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    # the metrics in the Prometheus text format. The file is replaced at once, so the collector never reads half of it
+    def write_textfile(self, path: str, record: dict):
+        script = f'script="{_escape(self.script)}"'
+        metrics = {}
+
+        def add(name: str, help_text: str, labels: str, value: float):
+            metrics.setdefault(name, (help_text, []))[1].append(f"{name}{{{labels}}} {value}")
+
+        add('jellyfin_run_duration_seconds', 'Wall time of the last run.', script, record['duration_seconds'])
+        add('jellyfin_run_cpu_seconds', 'CPU time of the last run.', script, record['cpu_seconds'])
+        add('jellyfin_run_timestamp_seconds', 'Unix time the last run started at.', script,
+            self._started_at.timestamp())
+        for name, stage in record['stages'].items():
+            labels = f'{script},stage="{_escape(name)}"'
+            add('jellyfin_stage_duration_seconds', 'Wall time of a stage of the last run.', labels, stage['wall'])
+            add('jellyfin_stage_requests', 'Http requests made by a stage of the last run.', labels,
+                stage['requests'])
+            if stage['rows'] is not None:
+                add('jellyfin_stage_rows', 'Rows produced by a stage of the last run.', labels, stage['rows'])
+        for name, metric in record['endpoints'].items():
+            labels = f'{script},endpoint="{_escape(name)}"'
+            add('jellyfin_http_requests', 'Http requests per endpoint in the last run.', labels, metric['requests'])
+            add('jellyfin_http_errors', 'Failed http requests per endpoint in the last run.', labels,
+                metric['errors'])
+            add('jellyfin_http_seconds', 'Time spent waiting for an endpoint in the last run.', labels,
+                metric['seconds'])
+            add('jellyfin_http_bytes', 'Bytes received from an endpoint in the last run.', labels, metric['bytes'])
+        for name, value in record['values'].items():
+            add(f"jellyfin_{_metric_name(name)}", f"{name} of the last run.", script, value)
+
+        lines = []
+        for name, (help_text, samples) in metrics.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", *samples]
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(f"{path}.{os.getpid()}.tmp", 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    # print the report and write the telemetry files that were asked for
+    def finish(self):
+        if not self.enabled:
+            return
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.pstats_path)
+        if self.print_report:
+            self.report()
+        if self.jsonl_path or self.textfile_path:
+            record = self.run_record()
+            if self.jsonl_path:
+                self.write_jsonl(self.jsonl_path, record)
+            if self.textfile_path:
+                self.write_textfile(self.textfile_path, record)
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+# the worker processes that build playlists get their song frames pickled and never import jellyfin_library,
+# so it is switched on here as well
+pd.options.mode.copy_on_write = True  # to avoid the SettingWithCopyWarning
+
+
+# draws random songs from a song table, the groups of songs (per artist, album, play count range, favourites)
+# are turned into arrays of row positions once so that every kind of sample is a single vectorized rng call
+class SongSampler:
+    def __init__(self, song_df: pd.DataFrame, rng: np.random.Generator):
+        self.song_df = song_df
+        self.rng = rng
+        self.ids = song_df.index.to_numpy()
+        self.favourites = np.flatnonzero(song_df['is_favorite'].to_numpy(dtype=bool))
+        self._groups = {}
+        self._play_count_ranges = {}
+
+    # the values of an attribute, the row positions sorted by value and where each value starts and how many it has
+    def _grouping(self, attribute: str) -> tuple[pd.Index, np.ndarray, np.ndarray, np.ndarray]:
+        if attribute not in self._groups:
+            # songs without a value (e.g. no album artist) are left out, just like they never match a value
+            codes, uniques = pd.factorize(self.song_df[attribute])
+            has_value = np.flatnonzero(codes >= 0)
+            order = has_value[np.argsort(codes[has_value], kind='stable')]
+            sizes = np.bincount(codes[has_value], minlength=len(uniques))
+            starts = np.cumsum(sizes) - sizes
+            self._groups[attribute] = (pd.Index(uniques), order, starts, sizes)
+        return self._groups[attribute]
+
+    # draw counts[g] songs with replacement from every group g, the songs of groups in `whole` are all taken instead
+    def _draw(self, order: np.ndarray, starts: np.ndarray, sizes: np.ndarray, counts: np.ndarray,
+              whole: np.ndarray) -> list:
+        counts = np.where(whole, sizes, counts)
+        group = np.repeat(np.arange(len(counts)), counts)
+        position_in_group = np.arange(len(group)) - np.repeat(np.cumsum(counts) - counts, counts)
+        random_offsets = (self.rng.random(len(group)) * sizes[group]).astype(np.int64)
+        offsets = np.where(whole[group], position_in_group, random_offsets)
+        return list(self.ids[order[starts[group] + offsets]])
+
+    # a-b random songs (with replacement) out of the given row positions
+    def choice(self, positions: np.ndarray, a: int, b: int) -> list:
+        n = self.rng.integers(a, b, endpoint=True)
+        if n == 0 or len(positions) == 0:
+            return []
+        return list(self.ids[self.rng.choice(positions, n)])
+
+    def positions(self, ids) -> np.ndarray:
+        positions = self.song_df.index.get_indexer(ids)
+        return positions[positions >= 0]
+
+    # a-b random songs for each of the given values of the attribute
+    def from_values(self, attribute: str, values, a: int, b: int) -> list:
+        uniques, order, starts, sizes = self._grouping(attribute)
+        groups = uniques.get_indexer(values)
+        groups = groups[groups >= 0]
+        counts = self.rng.integers(a, b, size=len(groups), endpoint=True)
+        return self._draw(order, starts[groups], sizes[groups], counts, np.zeros(len(groups), dtype=bool))
+
+    # a-b random songs for every value of the attribute, all songs of the values that have less than a songs
+    def by_attribute(self, attribute: str, a: int, b: int) -> list:
+        uniques, order, starts, sizes = self._grouping(attribute)
+        counts = self.rng.integers(a, b, size=len(sizes), endpoint=True)
+        return self._draw(order, starts, sizes, counts, sizes < a)
+
+    # a-b random songs with min_play_count < play_count < max_play_count
+    def by_play_count(self, min_play_count: int, max_play_count: int, a: int, b: int) -> list:
+        key = (min_play_count, max_play_count)
+        if key not in self._play_count_ranges:
+            play_count = self.song_df['play_count'].to_numpy()
+            self._play_count_ranges[key] = np.flatnonzero((play_count > min_play_count) &
+                                                          (play_count < max_play_count))
+        return self.choice(self._play_count_ranges[key], a, b)
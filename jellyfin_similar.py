@@ -0,0 +1,62 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from jellyfin_cache import CACHE_DIR, open_cache
+from jellyfin_client import JellyfinClient
+
+# number of similar items requests that run at the same time
+SIMILAR_WORKERS = int(os.getenv('SIMILAR_WORKERS')) if os.getenv('SIMILAR_WORKERS') else 8
+# similar items change rarely, so they are reused for this many days
+SIMILAR_CACHE_DAYS = float(os.getenv('SIMILAR_CACHE_DAYS')) if os.getenv('SIMILAR_CACHE_DAYS') else 7
+
+
+# looks up the similar items of songs concurrently and remembers them, only for the current run without a cache
+# directory
+class SimilarItems:
+    def __init__(self, client: JellyfinClient, workers: int = SIMILAR_WORKERS, cache_dir: str = CACHE_DIR):
+        self.client = client
+        self.workers = max(1, workers)
+        self.cache_path = os.path.join(cache_dir, 'similar.sqlite') if cache_dir else None
+        self.similar = None
+
+    def _open(self):
+        return open_cache(self.cache_path, 'CREATE TABLE IF NOT EXISTS similar (item_id TEXT PRIMARY KEY, '
+                                           'similar TEXT, fetched_at REAL)')
+
+    # read the entries that are still fresh from the disk cache
+    def _load(self) -> dict:
+        if not self.cache_path:
+            return {}
+        with self._open() as connection:
+            rows = connection.execute('SELECT item_id, similar FROM similar WHERE fetched_at >= ?',
+                                      (time.time() - SIMILAR_CACHE_DAYS * 24 * 60 * 60,))
+            return {item_id: json.loads(similar) for item_id, similar in rows}
+
+    def _store(self, results: dict):
+        if not self.cache_path:
+            return
+        with self._open() as connection:
+            fetched_at = time.time()
+            connection.executemany('INSERT OR REPLACE INTO similar VALUES (?, ?, ?)',
+                                   ((item_id, json.dumps(similar), fetched_at) for item_id, similar in results.items()))
+
+    def _request(self, song_id: str) -> list:
+        sessions = self.client.get(f"/Items/{song_id}/similar")
+        session_data = sessions.json()
+        return [i['Id'] for i in session_data.get('Items')]
+
+    # returns the similar items for every song, only songs that are not cached are requested
+    def get_many(self, song_ids) -> dict[str, list]:
+        if self.similar is None:
+            self.similar = self._load()
+        missing = [i for i in dict.fromkeys(song_ids) if i not in self.similar]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as executor:
+                results = dict(zip(missing, executor.map(self._request, missing)))
+            self.similar.update(results)
+            self._store(results)
+        return {i: self.similar[i] for i in song_ids}
+
+    def get(self, song_id: str) -> list:
+        return self.get_many([song_id])[song_id]
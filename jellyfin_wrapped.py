@@ -1,14 +1,24 @@
+from __future__ import annotations
+import argparse
 import math
+import multiprocessing
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from io import BytesIO
-import requests
+from functools import lru_cache
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
-import pandas as pd
-from collections import Counter
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
-import math
-import matplotlib.colors as mcolors
+from jellyfin_client import JellyfinClient
+from jellyfin_images import ItemImages
+from jellyfin_history import load_item_stats, load_item_stats_for_users, load_listen_data, load_listen_data_for_users
+from jellyfin_profile import Profiler, add_arguments
+
+# pandas, Pillow and matplotlib are only imported by the functions that use them, importing this module for its
+# functions or starting the script with --help stays fast
+if TYPE_CHECKING:
+    import pandas as pd
+    from PIL import Image
 
 load_dotenv()
 
@@ -20,15 +30,31 @@ CLIENT = 'JellyfinWrapped'
 DEVICE = 'JellyfinWrapped'
 VERSION = '1.0.0'
 
+MUSIC_LIBRARY_ID = '7e64e319657a9516ec78490da03edccb'
+
 JF_COLOR = "#000B25"
-CMAP = mcolors.LinearSegmentedColormap.from_list("", ["#AA5CC3", "#00A4DC"])
 
-headers = {'Authorization': f'MediaBrowser Client="{CLIENT}", Device="{DEVICE}", '
-                            f'Version="{VERSION}", Token="{API_KEY}"'}
+# the number of days of listen history for each duration
+DURATIONS = {
+    'year': 365,
+    'month': 31,
+    'week': 7,
+}
+
+client = JellyfinClient(JELLYFIN_IP, API_KEY, CLIENT, DEVICE, VERSION)
+artist_images = ItemImages(client, query='?fillHeight=500&fillWidth=500&quality=96')
+profiler = Profiler(client, 'wrapped')
+
+
+# the gradient of the jellyfin colors
+@lru_cache(maxsize=None)
+def colormap():
+    import matplotlib.colors as mcolors
+    return mcolors.LinearSegmentedColormap.from_list("", ["#AA5CC3", "#00A4DC"])
 
 
 def get_users(user=None) -> dict | str:
-    sessions = requests.get(f"{JELLYFIN_IP}/Users", headers=headers)
+    sessions = client.get("/Users")
     session_data = sessions.json()
     users = {}
     for i in session_data:
@@ -38,93 +64,76 @@ def get_users(user=None) -> dict | str:
     return users
 
 
-def get_all_songs(user_id: str) -> dict:
-    request = f"{JELLYFIN_IP}/Users/{user_id}/Items?SortBy=Album,SortName&SortOrder=Ascending&" \
-              f"IncludeItemTypes=Audio&Recursive=true&Fields=AudioInfo,ParentId,Path,Genres&StartIndex=0&ImageTypeLimit=1&" \
-              f"ParentId=7e64e319657a9516ec78490da03edccb"
-    sessions = requests.get(request, headers=headers)
-    session_data = sessions.json()
-    items = {}
-    print("Songs:", len(session_data.get('Items')))
-    for i in session_data.get('Items'):
-        play_count = i['UserData']['PlayCount']
-        try:
-            last_played = i['UserData']['LastPlayedDate']
-        except KeyError:
-            last_played = None
-        try:
-            album_id = i['AlbumId']
-        except KeyError:
-            continue
-        try:
-            album_artist = i['AlbumArtist']
-            if album_artist == 'Various Artists':
-                album_artist = i['Artists'][0]
-            artist_id = i['AlbumArtists'][0]['Id']
-        except:
-            album_artist = None
-        is_favorite = i['UserData']['IsFavorite']
-        song_name = i['Name']
-        path = i['Path']
-        genre = i['Genres']
-        # length in seconds
-        length = i['RunTimeTicks'] / 10000000
-        items[i['Id']] = {'song_name': song_name, 'play_count': play_count, 'last_played': last_played, 'path': path,
-                          'album_id': album_id, 'album_artist': album_artist, 'is_favorite': is_favorite,
-                          'length': length, 'genre': genre, 'artist_id': artist_id}
-    return items
+def get_all_songs(user_id: str) -> pd.DataFrame:
+    from jellyfin_library import load_songs
+    all_songs = load_songs(client, user_id, parent_id=MUSIC_LIBRARY_ID)
+    print("Songs:", len(all_songs))
+    return all_songs
+
+
+# the loaders return None if the request failed, which means the Playback Reporting plugin is missing
+def require_playback_reporting(result):
+    if result is None:
+        print("No Playback Reporting. Make sure it is installed")
+        sys.exit(1)
+    return result
 
 
 def retrieve_last_time_audio(user_id: str = None, duration='month'):
-        durations = {
-            'year': 365,
-            'month': 31,
-            'week': 7,
-        }
-        days_duration = durations[duration]
-        request = f"{JELLYFIN_IP}/user_usage_stats/submit_custom_query"
-        data = {'CustomQueryString': 'SELECT DateCreated, ItemId, PlayDuration '
-                                     'FROM PlaybackActivity '
-                                     f'WHERE UserId="{user_id}" '
-                                     f'AND ItemType="Audio" '
-                                     f'AND DateCreated >= DATE("now", "-{days_duration} days") '
-                                     'ORDER BY DateCreated DESC ',
-                'ReplaceUserId': False}
-        sessions = requests.post(request, headers=headers, json=data)
-        # check if the request was successful
-        if sessions.status_code != 200:
-            print("No Playback Reporting. Make sure it is installed")
-            sys.exit(1)
-        session_data = sessions.json()
-
-        if not session_data['results']:
-            return []
-        return session_data['results']
+    return require_playback_reporting(load_listen_data(client, user_id, days=DURATIONS[duration]))
+
+
+def retrieve_last_time_audio_for_users(user_ids: list, duration='month') -> dict[str, list]:
+    return require_playback_reporting(load_listen_data_for_users(client, user_ids, days=DURATIONS[duration]))
+
+
+# the plays of the user summed up per item as [ItemId, PlayCount, PlayDuration] rows
+def retrieve_item_stats(user_id: str = None, duration='month') -> list:
+    return require_playback_reporting(load_item_stats(client, user_id, days=DURATIONS[duration]))
+
+
+def retrieve_item_stats_for_users(user_ids: list, duration='month') -> dict[str, list]:
+    return require_playback_reporting(load_item_stats_for_users(client, user_ids, days=DURATIONS[duration]))
 
 
 def retrieve_artist_img(artist_id: str = None):
-    request = f"{JELLYFIN_IP}/Items/{artist_id}/Images/Primary?fillHeight=500&fillWidth=500&quality=96"
-    response = requests.get(request, headers=headers)
-    if response.status_code != 200:
+    content = artist_images.get(artist_id)
+    if content is None:
         print("Could not find artist")
         return None
-    return BytesIO(response.content)
+    return BytesIO(content)
+
+
+# plays and summed play duration of every listened item, the ranking functions all start from this
+def item_stats(listen_data: pd.DataFrame) -> pd.DataFrame:
+    import pandas as pd
+    play_duration = pd.to_numeric(listen_data['play_duration'])
+    stats = play_duration.groupby(listen_data['item_id']).agg(['size', 'sum'])
+    stats.columns = ['play_count', 'play_duration']
+    return stats
+
+
+# the same table from [ItemId, PlayCount, PlayDuration] rows that were already summed up by the server
+def item_stats_from_rows(rows: list) -> pd.DataFrame:
+    import pandas as pd
+    stats = pd.DataFrame(rows, columns=['item_id', 'play_count', 'play_duration']).set_index('item_id')
+    return stats.apply(pd.to_numeric)
+
 
+# the listened songs with how often they were played
+def listened_songs(all_songs: pd.DataFrame, stats: pd.DataFrame) -> pd.DataFrame:
+    all_songs = all_songs[all_songs.index.isin(stats.index)]
+    return all_songs.assign(play_count=stats['play_count'].reindex(all_songs.index).to_numpy())
 
-def rank_by_most_listened(all_songs: pd.DataFrame, listen_data: pd.DataFrame):
-    relevant_items = set(listen_data['item_id'])
-    all_songs = all_songs[all_songs.index.isin(relevant_items)]
-    song_play_count = Counter(listen_data['item_id'])
-    all_songs['play_count'] = all_songs.index.map(song_play_count)
-    artist_play_count = all_songs.groupby('album_artist')['play_count'].sum()
+
+def rank_by_most_listened(all_songs: pd.DataFrame, stats: pd.DataFrame):
+    all_songs = listened_songs(all_songs, stats)
+    artist_play_count = all_songs.groupby('album_artist', observed=True)['play_count'].sum()
     artist_play_count = artist_play_count.sort_values(ascending=False)
     return artist_play_count
 
-def get_best_songs(all_songs: pd.DataFrame, listen_data: pd.DataFrame, artist_id: str = None):
-    relevant_items = set(listen_data['item_id'])
-    all_songs = all_songs[all_songs.index.isin(relevant_items)]
-    song_play_count = Counter(listen_data['item_id'])
-    all_songs['play_count'] = all_songs.index.map(song_play_count)
+def get_best_songs(all_songs: pd.DataFrame, stats: pd.DataFrame, artist_id: str = None):
+    all_songs = listened_songs(all_songs, stats)
     if artist_id:
         artist_play_count = all_songs[all_songs['artist_id'] == artist_id]
         artist_play_count = artist_play_count.sort_values('play_count', ascending=False)
@@ -133,50 +142,93 @@ def get_best_songs(all_songs: pd.DataFrame, listen_data: pd.DataFrame, artist_id
     return artist_play_count
 
 
+# how long every play counts for: at most the length of the song, or 5 minutes if the song is no longer in the library
+def capped_play_duration(listen_data: pd.DataFrame, all_music: pd.DataFrame) -> pd.Series:
+    import pandas as pd
+    play_duration = pd.to_numeric(listen_data['play_duration'])
+    length = listen_data['item_id'].map(all_music['length'])
+    cap = length.where(listen_data['item_id'].isin(all_music.index), 300)
+    return play_duration.clip(upper=cap)
+
+
+# the capped play durations are added to the listen data so that they can be reused
 def total_play_time(listen_data: pd.DataFrame, all_music: pd.DataFrame):
     listen_data['play_duration'] = listen_data['play_duration'].astype(int)
-    total_listen_time = 0
-    found = 0
-    not_found = 0
-    for i, row in listen_data.iterrows():
-        if row['item_id'] in all_music.index:
-            total_listen_time += min(row['play_duration'], all_music.loc[row['item_id']]['length'])
-            found += 1
-        else:
-            not_found += 1
-            total_listen_time += min(row['play_duration'], 300)
+    if 'capped_play_duration' not in listen_data:
+        listen_data['capped_play_duration'] = capped_play_duration(listen_data, all_music)
+    found = int(listen_data['item_id'].isin(all_music.index).sum())
+    not_found = len(listen_data) - found
     print(f"Found songs: {found}, Songs no longer associated with an id: {not_found}")
-    total_listen_time = math.ceil(total_listen_time / 60)
+    total_listen_time = math.ceil(listen_data['capped_play_duration'].sum() / 60)
     return int(total_listen_time)
 
 
-def top_genres(all_songs: pd.DataFrame, listen_data: pd.DataFrame):
-    relevant_items = set(listen_data['item_id'])
-    all_songs = all_songs[all_songs.index.isin(relevant_items)]
-    song_play_count = Counter(listen_data['item_id'])
-    all_songs['play_count'] = all_songs.index.map(song_play_count)
-    all_songs['genre'] = all_songs['genre'].apply(lambda x: ', '.join(x))
-    genre_play_count = all_songs.groupby('genre')['play_count'].sum()
+# the play time from summed up plays, the single plays are not known so an item counts for at most
+# play count times its length instead of every play being capped at the length
+def total_play_time_from_stats(stats: pd.DataFrame, all_music: pd.DataFrame):
+    length = all_music['length'].reindex(stats.index)
+    found = int(stats['play_count'][length.notna()].sum())
+    not_found = int(stats['play_count'].sum()) - found
+    cap = stats['play_count'] * length.fillna(300)
+    total_listen_time = stats['play_duration'].clip(upper=cap).sum()
+    print(f"Found songs: {found}, Songs no longer associated with an id: {not_found}")
+    return int(math.ceil(total_listen_time / 60))
+
+
+def top_genres(all_songs: pd.DataFrame, stats: pd.DataFrame):
+    all_songs = listened_songs(all_songs, stats)
+    genre_play_count = all_songs.groupby('genre', observed=True)['play_count'].sum()
     genre_play_count = genre_play_count.sort_values(ascending=False)
     # remove empty genres
     genre_play_count = genre_play_count[genre_play_count.index != '']
     return genre_play_count
 
 
-def get_data(get_raw: bool = False):
-    user_id = get_users(USER_NAME)
-    all_music = get_all_songs(user_id)
-    audio = retrieve_last_time_audio(user_id, duration='year')
-    listen_data = pd.DataFrame(audio, columns=['date_created', 'item_id', 'play_duration'])
-    all_music = pd.DataFrame(all_music).T
-    best_artists = rank_by_most_listened(all_music, listen_data)
+# the library and the listen data can be passed in when they were already fetched for several users at once.
+# With aggregate the plays are summed up per item before they are sent, audio then holds these per item rows.
+# The raw data needs every single play, so aggregate is ignored for it.
+# Without fetch_image the id of the top artist is returned instead of the image, so that the images of several
+# users can be downloaded together
+def get_data(get_raw: bool = False, user_id: str = None, all_music: pd.DataFrame = None, audio: list = None,
+             aggregate: bool = False, fetch_image: bool = True):
+    import pandas as pd
+    aggregate = aggregate and not get_raw
+    user_id = user_id or get_users(USER_NAME)
+    if all_music is None:
+        with profiler.stage('get_all_songs') as stage:
+            all_music = get_all_songs(user_id)
+            stage['rows'] = len(all_music)
+        profiler.set('library_songs', len(all_music))
+    with profiler.stage('listen_data') as stage:
+        if aggregate:
+            stats = item_stats_from_rows(audio if audio is not None else retrieve_item_stats(user_id, duration='year'))
+            stage['rows'] = len(stats)
+        else:
+            audio = audio if audio is not None else retrieve_last_time_audio(user_id, duration='year')
+            listen_data = pd.DataFrame(audio, columns=['date_created', 'item_id', 'play_duration'])
+            stats = item_stats(listen_data)
+            stage['rows'] = len(listen_data)
+    profiler.add('listen_rows', stage['rows'])
+    with profiler.stage('rank_by_most_listened') as stage:
+        best_artists = rank_by_most_listened(all_music, stats)
+        stage['rows'] = len(best_artists)
     # for the best artist, get the image
     artist_id = all_music[all_music['album_artist'] == best_artists.index[0]].iloc[0]['artist_id']
-    artist_img = retrieve_artist_img(artist_id)
-    best_songs = get_best_songs(all_music, listen_data)['song_name']
+    with profiler.stage('retrieve_artist_img'):
+        artist_img = retrieve_artist_img(artist_id) if fetch_image else artist_id
+    with profiler.stage('get_best_songs') as stage:
+        best_songs = get_best_songs(all_music, stats)['song_name']
+        stage['rows'] = len(best_songs)
     # output_image = make_info_image(artist_img, best.index[0], best.iloc[0], best_songs)
-    total_listen_time = total_play_time(listen_data, all_music)
-    genres = top_genres(all_music, listen_data)
+    with profiler.stage('total_play_time'):
+        if aggregate:
+            total_listen_time = total_play_time_from_stats(stats, all_music)
+        else:
+            total_listen_time = total_play_time(listen_data, all_music)
+    profiler.add('listen_hours', total_listen_time / 60)
+    with profiler.stage('top_genres') as stage:
+        genres = top_genres(all_music, stats)
+        stage['rows'] = len(genres)
 
     if get_raw:
         # add to the listen data the song name as well as the length of the song if it is available
@@ -192,6 +244,7 @@ def get_data(get_raw: bool = False):
 
 
 def add_rounded_corners(image, radius):
+    from PIL import Image, ImageDraw
     # Create a mask for the image with rounded corners
     mask = Image.new("L", image.size, 0)
     draw = ImageDraw.Draw(mask)
@@ -207,6 +260,7 @@ def add_rounded_corners(image, radius):
 
 
 def add_shadow(canvas, image, position, shadow_offset=(10, 10), shadow_radius=15, shadow_color=(0, 0, 0, 100)):
+    from PIL import Image, ImageDraw, ImageFilter
     # Create a mask for the image with rounded corners
     mask = Image.new("L", image.size, 0)
     draw = ImageDraw.Draw(mask)
@@ -230,51 +284,68 @@ def add_shadow(canvas, image, position, shadow_offset=(10, 10), shadow_radius=15
     canvas.alpha_composite(shadow)
 
 
-def image_with_gradient(canvas_size):
-    image = Image.new('RGB', canvas_size, color=(255, 255, 255))
-    draw = ImageDraw.Draw(image)
-
+# the background only depends on the canvas size, so it is rendered once per size
+@lru_cache(maxsize=8)
+def _gradient(canvas_size) -> Image.Image:
+    import numpy as np
+    from PIL import Image
     # Get the dimensions
     width, height = canvas_size
 
-    # Create a gradient
-    for y in range(height):
-        for x in range(width):
-            # Calculate the interpolation value
-            t = ((x / width) + (y / height)) / 2  # Gradient diagonal
-            r, g, b, _ = CMAP(t)  # Get color from colormap
-            color = (int(r * 255), int(g * 255), int(b * 255))  # Convert to RGB
-            draw.point((x, y), fill=color)
+    # Create a diagonal gradient, the colormap is evaluated for all pixels at once
+    t = ((np.arange(width) / width)[np.newaxis, :] + (np.arange(height) / height)[:, np.newaxis]) / 2
+    colors = (colormap()(t)[..., :3] * 255).astype(np.uint8)  # Convert to RGB
+    return Image.fromarray(colors, 'RGB')
 
-    return image
 
+def image_with_gradient(canvas_size):
+    # callers draw on the image, so they get a copy of the cached one
+    return _gradient(tuple(canvas_size)).copy()
 
-def add_text(canvas, text, position, column_end=None, bold_font=False, font_size=30, color=(255, 255, 255)):
-    draw = ImageDraw.Draw(canvas)
+
+# fonts are loaded from disk once per style and size
+@lru_cache(maxsize=None)
+def load_font(bold_font: bool, font_size: int):
+    from PIL import ImageFont
     try:
         font_path = "Helvetica.ttf"
         font_bold_path = font_path.replace(".ttf", "-Bold.ttf")
 
         if bold_font:
-            font = ImageFont.truetype(font_bold_path, font_size)
-        else:
-            font = ImageFont.truetype(font_path, font_size)
+            return ImageFont.truetype(font_bold_path, font_size)
+        return ImageFont.truetype(font_path, font_size)
     except IOError:
-        font = ImageFont.load_default()  # Fallback to default font if specified font is unavailable
+        return ImageFont.load_default()  # Fallback to default font if specified font is unavailable
+
 
-    # Calculate the width and height of the text
-    bounding_box = draw.textbbox(position, text, font=font)
+@lru_cache(maxsize=4096)
+def text_width(text: str, bold_font: bool, font_size: int) -> int:
+    bounding_box = load_font(bold_font, font_size).getbbox(text)
+    return bounding_box[2] - bounding_box[0]
+
+
+# the longest start of the text followed by "..." that fits into the width, found by a binary search on the length
+def truncate_text(text: str, max_width: int, bold_font: bool, font_size: int) -> str:
+    if text_width(text, bold_font, font_size) <= max_width:
+        return text
+    low, high = 0, max(len(text) - 3, 0)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if text_width(text[:middle] + "...", bold_font, font_size) <= max_width:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "..."
+
+
+def add_text(canvas, text, position, column_end=None, bold_font=False, font_size=30, color=(255, 255, 255)):
+    from PIL import ImageDraw
+    draw = ImageDraw.Draw(canvas)
+    font = load_font(bold_font, font_size)
 
     # If a column end is specified, cut the text off at the column end
     if column_end:
-        text_width = bounding_box[2] - bounding_box[0]
-        while text_width > column_end - position[0]:
-            if text.endswith("..."):
-                text = text[:-4] + "..."
-            else:
-                text = text[:-3] + "..."
-            bounding_box = draw.textbbox(position, text, font=font)
-            text_width = bounding_box[2] - bounding_box[0]
+        text = truncate_text(text, column_end - position[0], bold_font, font_size)
 
     text_position = position
 
@@ -282,9 +353,18 @@ def add_text(canvas, text, position, column_end=None, bold_font=False, font_size
     draw.text(text_position, text, fill=color, font=font)
 
 
+# the logo is only read and resized once, it is pasted onto the canvas and not changed itself
+@lru_cache(maxsize=8)
+def load_logo(max_size: tuple) -> Image.Image:
+    from PIL import Image
+    logo = Image.open('jellyfin_logo.png')
+    logo.thumbnail(max_size, Image.HUFFMAN_ONLY)
+    return logo
+
+
 def make_info_image(artist_img, artist_names, play_time, song_names, top_genre, canvas_size=(600, 1100)):
+    from PIL import Image
     image = Image.open(artist_img)
-    logo = Image.open('jellyfin_logo.png')
     canvas = image_with_gradient(canvas_size).convert('RGBA')
 
     # Resize the image to fit within the center of the canvas, keeping the aspect ratio
@@ -295,7 +375,7 @@ def make_info_image(artist_img, artist_names, play_time, song_names, top_genre,
     logo_image_height = canvas_size[1] * 0.2
 
     image.thumbnail((max_image_width, max_image_height), Image.HUFFMAN_ONLY)
-    logo.thumbnail((logo_image_width, logo_image_height), Image.HUFFMAN_ONLY)
+    logo = load_logo((logo_image_width, logo_image_height))
 
     # Add rounded corners to the image
     corner_radius = min(image.size) // 20
@@ -348,8 +428,76 @@ def make_info_image(artist_img, artist_names, play_time, song_names, top_genre,
     return canvas
 
 
-if __name__ == '__main__':
-    if not API_KEY or not JELLYFIN_IP or not USER_NAME:
+# runs in a worker process, the image is passed as bytes as it is sent between the processes
+def save_info_image(path: str, artist_img: bytes, artist_names, play_time, song_names, top_genre) -> str:
+    out = make_info_image(BytesIO(artist_img), artist_names, play_time, song_names, top_genre)
+    out.save(path)
+    return path
+
+
+# make the wrapped of several users, the library and a year of listen data are fetched once for all of them.
+# The artist images are downloaded concurrently and the images are rendered in parallel
+def make_wrapped_for_users(user_names: list = None, aggregate: bool = False, workers: int = None):
+    from jellyfin_library import load_library
+    users = get_users()
+    if user_names:
+        users = {user_id: name for user_id, name in users.items() if name in user_names}
+    with profiler.stage('load_library') as stage:
+        all_music = load_library(client, MUSIC_LIBRARY_ID)
+        stage['rows'] = len(all_music)
+    profiler.set('library_songs', len(all_music))
+    print("Songs:", len(all_music))
+    with profiler.stage('listen_data_for_users') as stage:
+        if aggregate:
+            audio = retrieve_item_stats_for_users(list(users), duration='year')
+        else:
+            audio = retrieve_last_time_audio_for_users(list(users), duration='year')
+        stage['rows'] = sum(len(i) for i in audio.values())
+    summaries = {}
+    for user_id, name in users.items():
+        if not audio[user_id]:
+            print(f"{name} has not listened to any music, skipping")
+            continue
+        summaries[user_id] = get_data(user_id=user_id, all_music=all_music, audio=audio[user_id],
+                                      aggregate=aggregate, fetch_image=False)
+    with profiler.stage('retrieve_artist_imgs') as stage:
+        images = artist_images.get_many(summary[4] for summary in summaries.values())
+        stage['rows'] = len(images)
+
+    # the images are rendered in other processes, so the cpu time of this stage does not include them
+    with profiler.stage('render_images') as stage:
+        # spawn fresh processes instead of forking the open connections of this one
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {}
+            for user_id, (best_artists, best_songs, total_listen_time, best_genres, artist_id) in summaries.items():
+                if images[artist_id] is None:
+                    print(f"Could not find the top artist of {users[user_id]}, skipping")
+                    continue
+                futures[executor.submit(save_info_image, f'jellyfin_wrapped_{users[user_id]}.png', images[artist_id],
+                                        best_artists, total_listen_time, best_songs,
+                                        best_genres[0] if best_genres else '')] = user_id
+            for future in as_completed(futures):
+                print(f"Saved {future.result()}")
+        stage['rows'] = len(futures)
+    profiler.set('images', len(futures))
+
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog,
+                                     description="Create a Spotify Wrapped like summary of the last year of music.")
+    parser.add_argument('--users', nargs='+', metavar='NAME',
+                        help="make the wrapped of these users instead of USER_NAME and save them to files")
+    parser.add_argument('--all-users', action='store_true', help="make the wrapped of all users and save them to files")
+    parser.add_argument('--aggregate', action='store_true',
+                        help="let the server sum up the plays per song instead of sending every single play, "
+                             "the minutes played are then an estimate")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of processes that render the images in batch mode, defaults to the CPU count")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    batch = args.users or args.all_users
+
+    if not API_KEY or not JELLYFIN_IP or not (USER_NAME or batch):
         print("Please set the API_KEY, JELLYFIN_IP and USER_NAME environment variables.\nTo do this, make a copy of the"
               ".example.env file in the same directory as this script and fill it in with your values. "
               "Then rename it to .env.")
@@ -360,11 +508,25 @@ if __name__ == '__main__':
               "added to the wrapped")
         sys.exit(1)
 
+    profiler.start(args)
+
+    if batch:
+        make_wrapped_for_users(args.users, aggregate=args.aggregate, workers=args.workers)
+        profiler.finish()
+        sys.exit(0)
+
     # first get the data from the jellyfin_song_summary.py
-    best_artists, best_songs, total_listen_time, best_genres, artist_img = get_data()
+    best_artists, best_songs, total_listen_time, best_genres, artist_img = get_data(aggregate=args.aggregate)
     logo_data = 'jellyfin_logo.png'
 
-    out = make_info_image(artist_img, best_artists, total_listen_time, best_songs, 'Soundtrack')
+    with profiler.stage('make_info_image'):
+        out = make_info_image(artist_img, best_artists, total_listen_time, best_songs, 'Soundtrack')
 
     out.save('jellyfin_wrapped.png')
+    profiler.set('images', 1)
+    profiler.finish()
     out.show()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+import jellyfin_music
+
+
+# the per-event loop rank_recent_by_activity had before it was vectorized, kept as the reference
+def rank_recent_by_activity_loop(df: pd.DataFrame, list_activity: list, lookup_df) -> pd.DataFrame:
+    df['last_7_days'] = 1
+    for i in list_activity:
+        # check if the song has been played for at least 80% of the song
+        try:
+            if int(i[2]) <= lookup_df.loc[lookup_df.index == i[1], 'length'].values[0] * 0.8:
+                df.loc[df.index == i[1], 'last_7_days'] -= 1
+                continue
+        except IndexError:
+            continue
+        df.loc[df.index == i[1], 'last_7_days'] += 1
+    df['last_played'] = pd.to_datetime(df['last_played'], utc=True)
+    df['days_since_last_played'] = (pd.to_datetime('now', utc=True) - df['last_played']).dt.days
+    max_plays_7_days = df['last_7_days'].max()
+    df['rank'] = df.apply(lambda x: jellyfin_music.score_function(x['last_7_days'] / max_plays_7_days, x['play_count'],
+                                                                   x['days_since_last_played']), axis=1)
+    df = df.sort_values('rank', ascending=False)
+    return df.head(50)
+
+
+# a library with songs that were never played and a listen history that has plays of songs that are not in it
+def random_data(seed: int, songs: int, listens: int) -> tuple[pd.DataFrame, list]:
+    rng = np.random.default_rng(seed)
+    ids = [f"{i:032x}" for i in rng.choice(16 ** 6, songs, replace=False)]
+    now = pd.Timestamp.now(tz='UTC')
+    last_played = pd.Series(now - pd.to_timedelta(rng.integers(0, 60 * 24 * 3600, songs), unit='s'))
+    last_played[rng.random(songs) < 0.2] = pd.NaT
+    library = pd.DataFrame({
+        'song_name': [f"song {i}" for i in range(songs)],
+        'play_count': rng.integers(0, 12, songs),
+        'last_played': last_played.to_numpy(),
+        'album_artist': rng.choice(['a', 'b', 'c', None], songs),
+        'length': rng.integers(60, 400, songs).astype(float),
+    }, index=pd.Index(ids, name='Id'))
+    unknown = [f"{i:032x}" for i in range(16 ** 6, 16 ** 6 + 10)]
+    played = rng.choice(ids[:songs // 2] + unknown, listens)
+    activity = [[str(now), item_id, str(int(rng.integers(0, 420))), 'Jellyfin Web'] for item_id in played]
+    return library, activity
+
+
+@pytest.mark.parametrize('seed, songs, listens', [(0, 40, 200), (1, 120, 500), (2, 30, 0), (3, 200, 80)])
+def test_matches_per_event_loop(seed, songs, listens):
+    library, activity = random_data(seed, songs, listens)
+    df = library.sort_values('last_played', ascending=False).head(100)
+    expected = rank_recent_by_activity_loop(df.copy(), activity, library)
+    result = jellyfin_music.rank_recent_by_activity(df.copy(), activity, library)
+
+    assert sorted(result.index) == sorted(expected.index)
+    result = result.loc[expected.index]
+    pd.testing.assert_series_equal(result['last_7_days'], expected['last_7_days'], check_dtype=False)
+    pd.testing.assert_series_equal(result['days_since_last_played'], expected['days_since_last_played'],
+                                   check_dtype=False)
+    pd.testing.assert_series_equal(result['rank'], expected['rank'], check_dtype=False)
+
+
+def test_unknown_items_and_unplayed_songs():
+    library, _ = random_data(4, 20, 0)
+    library['play_count'] = 5
+    library['last_played'] = library['last_played'].fillna(pd.Timestamp.now(tz='UTC'))
+    library.iloc[0, library.columns.get_loc('last_played')] = pd.NaT
+    known = library.index[1]
+    activity = [['2026-01-01', known, '400', 'Jellyfin Web'], ['2026-01-01', 'f' * 32, '400', 'Jellyfin Web']]
+    result = jellyfin_music.rank_recent_by_activity(library.copy(), activity, library)
+
+    assert result.loc[known, 'last_7_days'] == 2
+    assert (result['last_7_days'].drop(known) == 1).all()
+    # a song without a last played date has no rank and is sorted last
+    assert np.isnan(result.loc[library.index[0], 'rank'])
+    assert result.index[-1] == library.index[0]